@@ -0,0 +1,87 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from time import monotonic
+from typing import Callable, Dict, List
+
+# Constants
+DEFAULT_BATCH_SIZE = 8
+DEFAULT_BATCH_MAX_WAIT = 0.05  # seconds a request may wait for others to fill its batch
+DEFAULT_MAX_BATCHES_IN_FLIGHT = 4
+
+
+class BatchItemError(Exception):
+    """
+    Raised for one item of a batch that the server reported as failed.
+    """
+
+
+class BatchingTransport:
+    """
+    Collects the requests made concurrently by the extraction workers and sends
+    them together, batch_size at a time, in one HTTP call. Each caller blocks
+    on its own item and receives only its own response.
+    """
+
+    def __init__(self, post_batch: Callable[[List[Dict]], List[Dict]], batch_size: int = DEFAULT_BATCH_SIZE,
+                 max_wait: float = DEFAULT_BATCH_MAX_WAIT, max_in_flight: int = DEFAULT_MAX_BATCHES_IN_FLIGHT):
+        self.post_batch = post_batch
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max_wait
+        self._pending = []  # (payload, future, enqueued_at)
+        self._condition = threading.Condition()
+        self._closed = False
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_in_flight), thread_name_prefix="vision-batch")
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="vision-batcher", daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, payload: Dict) -> str:
+        """
+        Queues one payload and waits for its text.
+        """
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Le transport par lots est fermé.")
+            self._pending.append((payload, future, monotonic()))
+            self._condition.notify_all()
+        return future.result()
+
+    def _dispatch_loop(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if self._closed and not self._pending:
+                    return
+                # Wait until the batch is full or its oldest request has waited long enough
+                deadline = self._pending[0][2] + self.max_wait
+                while len(self._pending) < self.batch_size and not self._closed:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(timeout=remaining)
+                batch = self._pending[:self.batch_size]
+                del self._pending[:self.batch_size]
+            self._executor.submit(self._send, batch)
+
+    def _send(self, batch: list):
+        try:
+            outputs = self.post_batch([payload for payload, _, _ in batch])
+            if len(outputs) != len(batch):
+                raise BatchItemError(f"Le serveur a renvoyé {len(outputs)} réponses pour {len(batch)} requêtes.")
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        for (_, future, _), output in zip(batch, outputs):
+            if output.get("error"):
+                future.set_exception(BatchItemError(str(output["error"])))
+            else:
+                future.set_result(output.get("text") or output.get("output", ""))
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._dispatcher.join(timeout=5)
+        self._executor.shutdown(wait=False)
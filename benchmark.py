@@ -0,0 +1,145 @@
+"""
+End-to-end throughput benchmark of the extraction pipeline, run offline
+against the local mock vision server on a synthetic project.
+
+    python benchmark.py --patients 50 --pages 3 --workers 8 --latency-ms 800 --jitter-ms 200
+"""
+import io
+import os
+import json
+import shutil
+import argparse
+import tempfile
+import contextlib
+from time import perf_counter
+from typing import Dict
+from PIL import Image, ImageDraw
+
+import ocr
+from extraction_engine import ExtractionEngine, DEFAULT_EXTRACTION_SETTINGS, get_extract_options
+from mock_vision_server import start_mock_server
+from metrics import MetricsLog, percentile
+
+# Constants
+PAGE_SIZE = (1240, 1754)  # A4 at 150 dpi
+
+
+def create_synthetic_project(directory: str, patients: int, pages: int, variables_count: int) -> tuple:
+    """
+    Writes synthetic questionnaire scans, organises them with
+    prepare_patient_folders and returns (questionnaires, variables).
+    """
+    scans_dir = os.path.join(directory, "scans")
+    os.makedirs(scans_dir, exist_ok=True)
+    variables = []
+    for i in range(variables_count):
+        if i % 4 == 3:
+            variables.append({"name": f"Question {i + 1}", "type": "group", "options": ["Oui", "Non", "NSP"]})
+        else:
+            variables.append({"name": f"Champ {i + 1}", "type": "text", "options": []})
+
+    for patient in range(patients):
+        for page in range(pages):
+            img = Image.new("RGB", PAGE_SIZE, (255, 255, 255))
+            draw = ImageDraw.Draw(img)
+            draw.text((80, 60), f"Questionnaire {patient + 1} - page {page + 1}", fill=(0, 0, 0))
+            for row, var in enumerate(variables):
+                y = 140 + row * 40
+                if y > PAGE_SIZE[1] - 80:
+                    break
+                draw.text((80, y), f"{var['name']} :", fill=(0, 0, 0))
+                draw.rectangle((400, y - 5, 1100, y + 25), outline=(0, 0, 0))
+            img.save(os.path.join(scans_dir, f"scan_{patient * pages + page + 1:05d}.jpg"), quality=90)
+            img.close()
+
+    questionnaires = ocr.prepare_patient_folders(scans_dir, os.path.join(directory, "patients"), pages)
+    return questionnaires, variables
+
+
+def run_benchmark(patients: int = 20, pages: int = 2, variables_count: int = 20, workers: int = 4,
+                  latency: float = 0.5, jitter: float = 0.1, error_rate: float = 0.0,
+                  settings: Dict = None, verbose: bool = False) -> Dict:
+    """
+    Runs the GUI's extraction loop (ExtractionEngine over
+    extract_data_from_image_folder) and returns throughput figures.
+    """
+    settings = dict(DEFAULT_EXTRACTION_SETTINGS, **(settings or {}))
+    work_dir = tempfile.mkdtemp(prefix="autoquest_bench_")
+    server = start_mock_server(latency=latency, jitter=jitter, error_rate=error_rate, seed=0)
+    try:
+        questionnaires, variables = create_synthetic_project(work_dir, patients, pages, variables_count)
+
+        # Same wiring as a project (no response cache without a project folder), pointed at the mock server
+        ocr.configure_from_settings(settings)
+        ocr.configure_vision_client(endpoint=server.url)
+        ocr.configure_retry_policy(base_delay=0.1, max_delay=1)
+        ocr.get_vision_client().reset_stats()
+
+        metrics_log = MetricsLog()
+        engine = ExtractionEngine(ocr.extract_data_from_image_folder, variables, max_workers=workers,
+                                  extract_options=get_extract_options(settings), metrics_log=metrics_log)
+        start = perf_counter()
+        output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+        with output:
+            summary = engine.run(questionnaires)
+        wall_seconds = perf_counter() - start
+
+        client_stats = ocr.get_vision_client().reset_stats()
+        run_metrics = metrics_log.close()
+        latencies = [record["total_ms"] / 1000 for record in metrics_log.records]
+        return {
+            "patients": len(questionnaires),
+            "pages_per_patient": pages,
+            "variables": variables_count,
+            "workers": workers,
+            "processed": summary["processed"],
+            "errors": summary["errors"],
+            "wall_seconds": round(wall_seconds, 2),
+            "patients_per_minute": round(len(questionnaires) / wall_seconds * 60, 1) if wall_seconds else 0.0,
+            "latency_p50_s": round(percentile(latencies, 50), 3),
+            "latency_p95_s": round(percentile(latencies, 95), 3),
+            "requests": client_stats["requests"],
+            "bytes_sent": client_stats["bytes_sent"],
+            "bytes_per_patient": client_stats["bytes_sent"] // max(1, len(questionnaires)),
+            "stages_p50_ms": run_metrics["stages_p50_ms"],
+            "server": dict(server.stats),
+        }
+    finally:
+        ocr.configure_batching(False)
+        server.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mesure le débit d'extraction contre un serveur de vision simulé.")
+    parser.add_argument("--patients", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=2, help="pages par questionnaire")
+    parser.add_argument("--variables", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=DEFAULT_EXTRACTION_SETTINGS["max_workers"])
+    parser.add_argument("--latency-ms", type=float, default=500)
+    parser.add_argument("--jitter-ms", type=float, default=100)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--settings", help="fichier JSON de paramètres d'extraction (format du projet)")
+    parser.add_argument("--json", dest="json_output", help="écrit le rapport dans ce fichier JSON")
+    parser.add_argument("--verbose", action="store_true", help="affiche les journaux de l'extraction")
+    args = parser.parse_args()
+
+    settings = {}
+    if args.settings:
+        with open(args.settings, 'r', encoding='utf-8') as f:
+            settings = json.load(f)
+
+    report = run_benchmark(patients=args.patients, pages=args.pages, variables_count=args.variables,
+                           workers=args.workers, latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000,
+                           error_rate=args.error_rate, settings=settings, verbose=args.verbose)
+
+    print("📈 Résultats du banc d'essai :")
+    for key, value in report.items():
+        print(f"  {key}: {value}")
+    if args.json_output:
+        with open(args.json_output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
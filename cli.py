@@ -0,0 +1,260 @@
+"""
+Headless entry point, for long runs on a server without a display. Works on
+the same project folders as the GUI.
+
+    python cli.py PROJET import SCANS --pages 4
+    python cli.py PROJET detect --add
+    python cli.py PROJET prompt
+    python cli.py PROJET extract --workers 16 --resume
+    python cli.py PROJET export --format csv --only-changed
+    python cli.py PROJET run --source SCANS --pages 4 --workers 16 --resume --format parquet
+"""
+import os
+import sys
+import argparse
+from typing import Dict, Optional
+
+from extraction_engine import ExtractionEngine, get_extraction_settings, get_extract_options, \
+    select_patients_to_extract, MAX_WORKERS_LIMIT
+from project_store import ProjectStore, open_project_store, new_project_data, is_project_folder
+from exporter import EXPORT_FORMATS, export_data
+from metrics import open_run_log, format_summary
+from ocr import prepare_patient_folders, detect_variables_from_image_folder, extract_data_from_image_folder, \
+    configure_from_settings, prompt_size_report, format_prompt_report
+
+# Constants
+DEFAULT_EXPORT_NAME = "donnees_extraites"
+EXIT_OK = 0
+EXIT_FAILURE = 1
+EXIT_INTERRUPTED = 130
+MODEL_COMMANDS = ("detect", "extract", "run")  # commands that call the vision model
+
+
+def open_project(project_path: str, create: bool = False) -> ProjectStore:
+    """
+    Opens a project folder, creating it like the GUI's "Nouveau projet" if asked.
+    """
+    if not is_project_folder(project_path):
+        if not create:
+            raise SystemExit(f"❌ {project_path} n'est pas un projet AutoQuest (utilisez import pour le créer).")
+        os.makedirs(os.path.join(project_path, "patients"), exist_ok=True)
+        os.makedirs(os.path.join(project_path, "exports"), exist_ok=True)
+        store = open_project_store(project_path)
+        store.save(new_project_data())
+        print(f"🆕 Projet créé : {project_path}")
+        return store
+    return open_project_store(project_path)
+
+
+def project_settings(project_data: Dict, workers: Optional[int] = None, debug: bool = False) -> Dict:
+    settings = get_extraction_settings(project_data)
+    if workers:
+        settings["max_workers"] = max(1, min(MAX_WORKERS_LIMIT, workers))
+    if debug:
+        settings["debug_output"] = True
+    return settings
+
+
+def cmd_import(store: ProjectStore, project_data: Dict, args) -> int:
+    source_dir = os.path.abspath(args.source)
+    if not os.path.isdir(source_dir):
+        print(f"❌ Dossier de scans introuvable : {source_dir}")
+        return EXIT_FAILURE
+    settings = project_settings(project_data)
+    project_data['scans_source_dir'] = source_dir
+    project_data['pages_per_questionnaire'] = args.pages
+
+    printed = {"done": 0}
+
+    def on_file_imported(done, total):
+        # Also called with no new file while the import waits for resources
+        if done != printed["done"] and (done == total or done % 100 == 0):
+            printed["done"] = done
+            print(f"📥 {done}/{total} fichiers importés")
+
+    project_data['compiled_questionnaires'] = prepare_patient_folders(
+        source_dir, os.path.join(store.project_path, "patients"), args.pages,
+        import_mode=args.import_mode or settings["import_mode"], progress_callback=on_file_imported)
+    store.save(project_data, include_extractions=False)
+    print(f"✅ {len(project_data['compiled_questionnaires'])} dossiers patient préparés.")
+    return EXIT_OK if project_data['compiled_questionnaires'] else EXIT_FAILURE
+
+
+def cmd_detect(store: ProjectStore, project_data: Dict, args) -> int:
+    questionnaires = project_data.get('compiled_questionnaires')
+    if not questionnaires:
+        print("❌ Aucun dossier patient : lancez d'abord la commande import.")
+        return EXIT_FAILURE
+    # Same sample as the GUI: the first patient's folder
+    result = detect_variables_from_image_folder(questionnaires[0]['patient_dir'])
+    if result.get("errors"):
+        print("❌ " + "\n".join(result["errors"]))
+        return EXIT_FAILURE
+
+    existing_vars = {v['name'] if isinstance(v, dict) else v for v in project_data.get('variables', [])}
+    new_vars = [v for v in result.get("variables", []) if v not in existing_vars]
+    print(f"🔎 {len(result.get('variables', []))} variable(s) détectée(s), {len(new_vars)} nouvelle(s) :")
+    for name in new_vars:
+        print(f"  - {name}")
+    if args.add and new_vars:
+        project_data['variables'].extend({"name": name, "type": "text", "options": []} for name in new_vars)
+        store.save(project_data, include_extractions=False)
+        print(f"✅ {len(new_vars)} variable(s) ajoutée(s) au projet.")
+    return EXIT_OK
+
+
+def cmd_extract(store: ProjectStore, project_data: Dict, args) -> int:
+    patients = project_data.get('compiled_questionnaires', [])
+    variables = project_data.get('variables', [])
+    if not patients or not variables:
+        print("❌ Il faut des dossiers patient (import) et des variables (detect --add) avant l'extraction.")
+        return EXIT_FAILURE
+
+    extracted_data = project_data['extracted_data']
+    if args.resume:
+        patients = select_patients_to_extract(patients, variables, extracted_data)
+        print(f"⏩ Reprise : {len(patients)} patient(s) nouveau(x), modifié(s) ou en erreur à traiter.")
+        if not patients:
+            return EXIT_OK
+
+    settings = project_settings(project_data, args.workers)
+    print(format_prompt_report(prompt_size_report(variables, settings["variable_chunk_size"])))
+    total = len(patients)
+    completed = {"count": 0}
+
+    def on_result(index, patient_id, entry):
+        extracted_data[patient_id] = entry
+        # Saved as it arrives: an interrupted run resumes where it stopped
+        store.save_extraction(patient_id, entry)
+        completed["count"] += 1
+        status = f"❌ {entry['error']}" if entry.get("error") else "✅"
+        print(f"[{completed['count']}/{total}] {patient_id} {status}")
+
+    metrics_log = open_run_log(store.project_path)
+    store.responses.start_run()
+    engine = ExtractionEngine(extract_data_from_image_folder, variables,
+                              max_workers=settings["max_workers"],
+                              extract_options=get_extract_options(settings),
+                              metrics_log=metrics_log)
+    try:
+        summary = engine.run(patients, on_result=on_result)
+    except KeyboardInterrupt:
+        print("\n⏹️ Extraction interrompue, les résultats obtenus sont enregistrés. Relancez avec --resume.")
+        return EXIT_INTERRUPTED
+    finally:
+        run_metrics = metrics_log.close()
+        store.responses.end_run()
+    print(f"📊 Patients traités : {summary['processed']}, en erreur : {summary['errors']}")
+    print(format_summary(run_metrics))
+    print(f"📁 Mesures détaillées : {metrics_log.path}")
+    return EXIT_OK if summary['errors'] == 0 else EXIT_FAILURE
+
+
+def cmd_prompt(store: ProjectStore, project_data: Dict, args) -> int:
+    """
+    Prompt sizes, to check that the server's prefix cache can apply.
+    """
+    variables = project_data.get('variables', [])
+    if not variables:
+        print("❌ Aucune variable définie.")
+        return EXIT_FAILURE
+    settings = project_settings(project_data)
+    print(format_prompt_report(prompt_size_report(variables, settings["variable_chunk_size"])))
+    return EXIT_OK
+
+
+def cmd_export(store: ProjectStore, project_data: Dict, args) -> int:
+    if not project_data.get('extracted_data'):
+        print("❌ Aucune donnée extraite à exporter.")
+        return EXIT_FAILURE
+    output = args.output or os.path.join(store.project_path, "exports", f"{DEFAULT_EXPORT_NAME}.{args.format or 'xlsx'}")
+
+    def on_progress(done, total):
+        if done == total or done % 1000 == 0:
+            print(f"📤 {done}/{total} patients exportés")
+
+    summary = export_data(project_data['extracted_data'], project_data.get('variables', []), output,
+                          fmt=args.format, only_changed=args.only_changed, progress_callback=on_progress)
+    if not summary['path']:
+        print("✅ Aucun patient nouveau ou modifié depuis la dernière exportation.")
+    else:
+        print(f"✅ {summary['rows']} ligne(s) exportée(s) vers {summary['path']}")
+    return EXIT_OK
+
+
+def cmd_run(store: ProjectStore, project_data: Dict, args) -> int:
+    """
+    Import (when --source is given), extraction and export in one go.
+    """
+    if args.source:
+        status = cmd_import(store, project_data, args)
+        if status != EXIT_OK:
+            return status
+    status = cmd_extract(store, project_data, args)
+    if status == EXIT_INTERRUPTED:
+        return status
+    export_status = cmd_export(store, project_data, args)
+    return status if status != EXIT_OK else export_status
+
+
+COMMANDS = {
+    "import": cmd_import,
+    "detect": cmd_detect,
+    "extract": cmd_extract,
+    "prompt": cmd_prompt,
+    "export": cmd_export,
+    "run": cmd_run,
+}
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="AutoQuest en ligne de commande (sans interface graphique).")
+    parser.add_argument("project", help="dossier du projet (le même que dans l'interface)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    formats = [fmt for fmt, _ in EXPORT_FORMATS]
+
+    import_parser = subparsers.add_parser("import", help="organise les scans en dossiers patient")
+    import_parser.add_argument("source", help="dossier contenant les scans")
+    import_parser.add_argument("--pages", type=int, required=True, help="pages par questionnaire")
+    import_parser.add_argument("--import-mode", choices=["auto", "copy"])
+
+    detect_parser = subparsers.add_parser("detect", help="détecte les variables sur le premier patient")
+    detect_parser.add_argument("--add", action="store_true", help="ajoute les nouvelles variables au projet")
+
+    extract_parser = subparsers.add_parser("extract", help="extrait les données de tous les patients")
+    subparsers.add_parser("prompt", help="taille des prompts d'extraction et part du préambule commun")
+    export_parser = subparsers.add_parser("export", help="exporte les données extraites")
+    run_parser = subparsers.add_parser("run", help="import (si --source), extraction puis export")
+    run_parser.add_argument("--source", help="dossier contenant les scans")
+    run_parser.add_argument("--pages", type=int, default=1, help="pages par questionnaire")
+    run_parser.add_argument("--import-mode", choices=["auto", "copy"])
+
+    for sub in (extract_parser, run_parser):
+        sub.add_argument("--workers", type=int, help="patients traités en parallèle (remplace le paramètre du projet)")
+        sub.add_argument("--resume", action="store_true",
+                         help="ne traite que les patients nouveaux, modifiés ou en erreur")
+        sub.add_argument("--debug", action="store_true", help="affiche les réponses brutes du modèle")
+    for sub in (export_parser, run_parser):
+        sub.add_argument("--format", choices=formats, help="format du fichier (sinon déduit de --output)")
+        sub.add_argument("--output", help=f"fichier de sortie (défaut : exports/{DEFAULT_EXPORT_NAME}.xlsx)")
+        sub.add_argument("--only-changed", action="store_true",
+                         help="n'exporte que les patients nouveaux ou modifiés depuis la dernière exportation")
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    store = open_project(os.path.abspath(args.project), create=args.command in ("import", "run"))
+    try:
+        project_data = store.load()
+        if args.command in MODEL_COMMANDS:
+            # Same endpoint, retry policy and cache as the GUI for this project
+            configure_from_settings(project_settings(project_data, getattr(args, "workers", None),
+                                                     getattr(args, "debug", False)), store.project_path)
+        return COMMANDS[args.command](store, project_data, args)
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
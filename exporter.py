@@ -0,0 +1,259 @@
+import os
+import csv
+import json
+import hashlib
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, List, Optional
+
+# Constants
+EXPORT_FORMAT_XLSX = "xlsx"
+EXPORT_FORMAT_CSV = "csv"
+EXPORT_FORMAT_PARQUET = "parquet"
+EXPORT_FORMATS = [
+    (EXPORT_FORMAT_XLSX, "Fichiers Excel (*.xlsx)"),
+    (EXPORT_FORMAT_CSV, "Fichiers CSV (*.csv)"),
+    (EXPORT_FORMAT_PARQUET, "Fichiers Parquet (*.parquet)"),
+]
+EXPORT_STATE_SUFFIX = ".export_state.json"
+PARQUET_ROW_GROUP_SIZE = 5000
+PROGRESS_EVERY = 100  # rows between two progress updates
+POLL_INTERVAL = 0.1  # seconds
+
+
+class ExportCancelled(Exception):
+    """
+    Raised inside the export thread when the user cancels.
+    """
+
+
+def export_format_for_path(path: str) -> str:
+    extension = os.path.splitext(path)[1].lower().lstrip(".")
+    if extension not in {fmt for fmt, _ in EXPORT_FORMATS}:
+        raise ValueError(f"Format d'exportation non pris en charge : .{extension}")
+    return extension
+
+
+def export_columns(variables: List) -> List[str]:
+    return ["Patient"] + [v['name'] if isinstance(v, dict) else str(v) for v in variables]
+
+
+def _cell(value):
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _row_digest(row: List) -> str:
+    return hashlib.sha1(json.dumps(row, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+
+class _XlsxWriter:
+    def __init__(self, path: str, columns: List[str]):
+        from openpyxl import Workbook
+        self.path = path
+        # Write-only mode streams rows to disk instead of keeping every cell in memory
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet("Données")
+        self.sheet.append(columns)
+
+    def write(self, row: List):
+        self.sheet.append(row)
+
+    def close(self):
+        self.workbook.save(self.path)
+
+
+class _CsvWriter:
+    def __init__(self, path: str, columns: List[str]):
+        # utf-8-sig so that Excel opens accented characters correctly
+        self.file = open(path, 'w', encoding="utf-8-sig", newline='')
+        self.writer = csv.writer(self.file, delimiter=';')
+        self.writer.writerow(columns)
+
+    def write(self, row: List):
+        self.writer.writerow(["" if value is None else value for value in row])
+
+    def close(self):
+        self.file.close()
+
+
+class _ParquetWriter:
+    def __init__(self, path: str, columns: List[str]):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("L'export Parquet nécessite le paquet 'pyarrow' (pip install pyarrow).")
+        self.pa = pa
+        self.columns = columns
+        self.schema = pa.schema([(name, pa.string()) for name in columns])
+        self.writer = pq.ParquetWriter(path, self.schema)
+        self.buffer = []
+
+    def write(self, row: List):
+        self.buffer.append(row)
+        if len(self.buffer) >= PARQUET_ROW_GROUP_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if not self.buffer:
+            return
+        arrays = [self.pa.array([None if row[i] is None else str(row[i]) for row in self.buffer], self.pa.string())
+                  for i in range(len(self.columns))]
+        self.writer.write_table(self.pa.Table.from_arrays(arrays, schema=self.schema))
+        self.buffer = []
+
+    def close(self):
+        self._flush()
+        self.writer.close()
+
+
+def _open_writer(fmt: str, path: str, columns: List[str]):
+    if fmt == EXPORT_FORMAT_XLSX:
+        return _XlsxWriter(path, columns)
+    if fmt == EXPORT_FORMAT_CSV:
+        return _CsvWriter(path, columns)
+    return _ParquetWriter(path, columns)
+
+
+def load_export_state(path: str) -> Dict:
+    try:
+        with open(path + EXPORT_STATE_SUFFIX, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def save_export_state(path: str, state: Dict):
+    tmp_path = path + EXPORT_STATE_SUFFIX + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path + EXPORT_STATE_SUFFIX)
+
+
+def incremental_output_path(path: str) -> str:
+    """
+    New and changed rows go to a dated file next to the full export, in every
+    format: appended to the full file, a changed patient would appear twice
+    with conflicting values.
+    """
+    stem, extension = os.path.splitext(path)
+    return f"{stem}_ajout_{datetime.now().strftime('%Y%m%d_%H%M%S')}{extension}"
+
+
+def export_data(extracted_data: Dict, variables: List, path: str, fmt: Optional[str] = None,
+                only_changed: bool = False,
+                progress_callback: Optional[Callable[[int, int], None]] = None,
+                should_cancel: Optional[Callable[[], bool]] = None) -> Dict:
+    """
+    Streams one row per patient to path. With only_changed, rows identical to
+    those of the previous export to the same path are skipped, using a state
+    file next to the export. Returns {"path", "rows", "skipped"}.
+    """
+    fmt = fmt or export_format_for_path(path)
+    columns = export_columns(variables)
+    state = load_export_state(path) if only_changed else {}
+    if state.get("columns") != columns:
+        # Different columns: appending would misalign the rows, start over
+        state = {}
+    exported = state.get("rows", {})
+    append = bool(exported)
+
+    items = list(extracted_data.items())
+    total = len(items)
+    pending_rows = []
+    digests = {}
+    skipped = 0
+    for patient_id, result in items:
+        values = (result.get('data') or {}).get('variables') or {}
+        row = [patient_id] + [_cell(values.get(name)) for name in columns[1:]]
+        digest = _row_digest(row)
+        if append and exported.get(patient_id) == digest:
+            skipped += 1
+            continue
+        pending_rows.append(row)
+        digests[patient_id] = digest
+
+    output_path = incremental_output_path(path) if append else path
+    if append and not pending_rows:
+        if progress_callback:
+            progress_callback(total, total)
+        return {"path": None, "rows": 0, "skipped": skipped}
+
+    # Written to a temporary file first, so cancelling keeps the previous export
+    write_path = output_path + ".tmp"
+    writer = None
+    try:
+        writer = _open_writer(fmt, write_path, columns)
+        for done, row in enumerate(pending_rows, start=1):
+            if should_cancel and done % PROGRESS_EVERY == 0 and should_cancel():
+                raise ExportCancelled()
+            writer.write(row)
+            if progress_callback and (done % PROGRESS_EVERY == 0 or done == len(pending_rows)):
+                progress_callback(skipped + done, total)
+        writer.close()
+        writer = None
+        os.replace(write_path, output_path)
+    except BaseException:
+        if writer is not None:
+            try:
+                writer.close()
+            except Exception:
+                pass
+        if os.path.exists(write_path):
+            os.remove(write_path)
+        raise
+
+    exported.update(digests)
+    save_export_state(path, {"columns": columns, "format": fmt, "rows": exported,
+                             "exported_at": datetime.now().isoformat(timespec="seconds")})
+    return {"path": output_path, "rows": len(pending_rows), "skipped": skipped}
+
+
+class ExportJob:
+    """
+    Runs export_data on a worker thread while the caller's thread keeps
+    polling, the same way ExtractionEngine keeps the GUI responsive.
+    """
+
+    def __init__(self, extracted_data: Dict, variables: List, path: str, fmt: Optional[str] = None,
+                 only_changed: bool = False):
+        self.extracted_data = extracted_data
+        self.variables = variables
+        self.path = path
+        self.fmt = fmt
+        self.only_changed = only_changed
+        self._progress = (0, len(extracted_data))
+        self._cancel_event = threading.Event()
+
+    def _on_progress(self, done: int, total: int):
+        self._progress = (done, total)
+
+    def run(self, on_progress: Optional[Callable[[int, int], None]] = None,
+            should_cancel: Optional[Callable[[], bool]] = None,
+            on_idle: Optional[Callable[[], None]] = None) -> Optional[Dict]:
+        """
+        Returns the export summary, or None if it was cancelled.
+        """
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="export") as executor:
+            future = executor.submit(export_data, self.extracted_data, self.variables, self.path, self.fmt,
+                                     self.only_changed, self._on_progress, self._cancel_event.is_set)
+            while True:
+                try:
+                    summary = future.result(timeout=POLL_INTERVAL)
+                    break
+                except FutureTimeoutError:
+                    pass
+                except ExportCancelled:
+                    return None
+                if should_cancel and should_cancel():
+                    self._cancel_event.set()
+                if on_progress:
+                    on_progress(*self._progress)
+                if on_idle:
+                    on_idle()
+        if on_progress:
+            on_progress(*self._progress)
+        return summary
@@ -0,0 +1,219 @@
+import os
+import json
+import hashlib
+import threading
+from metrics import MetricsLog, patient_metrics
+from resource_governor import run_cancellable, cancel_run
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, List, Optional
+
+# Constants
+DEFAULT_MAX_WORKERS = 4
+MAX_WORKERS_LIMIT = 32
+POLL_INTERVAL = 0.1  # seconds
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+DEFAULT_EXTRACTION_SETTINGS = {
+    "max_workers": DEFAULT_MAX_WORKERS,
+    "vision_endpoint": "",  # empty: use ocr.DEFAULT_VISION_ENDPOINT
+    "pool_size": 16,
+    "connect_timeout": 10,
+    "read_timeout": 300,
+    "streaming_enabled": False,  # read /generate as a token stream
+    "stall_timeout": 30,  # seconds without a token before a streamed request is retried
+    "batching_enabled": False,
+    "batch_size": 8,
+    "batch_max_wait_ms": 50,
+    "batch_endpoint": "",  # empty: vision endpoint + "_batch"
+    "max_attempts": 3,
+    "retry_base_delay": 2,
+    "retry_max_delay": 60,
+    "breaker_threshold": 5,
+    "breaker_cooldown": 60,
+    "cache_enabled": True,
+    "cache_max_mb": 512,
+    "merge_mode": "streaming",
+    "extraction_mode": "merged",
+    "pages_per_request": 1,
+    "max_parallel_requests": 4,
+    "variable_chunk_size": 0,  # 0: all variables in one prompt
+    "requery_missing": True,  # ask again, once, for keys missing from an answer
+    "image_format": "PNG",
+    "image_quality": 85,
+    "max_memory_percent": 90,
+    "max_cpu_percent": 90,
+    "import_mode": "auto",  # "auto": link scans when possible, "copy": always copy
+    "debug_output": False,  # print raw model responses and extracted values
+}
+
+# Settings forwarded as keyword arguments to the extraction function
+EXTRACT_OPTION_KEYS = ("merge_mode", "extraction_mode", "pages_per_request", "max_parallel_requests",
+                       "variable_chunk_size", "image_format", "image_quality", "requery_missing")
+
+
+def get_extraction_settings(project_data: Dict) -> Dict:
+    """
+    Returns the project's extraction settings, completed with the defaults.
+    """
+    settings = dict(DEFAULT_EXTRACTION_SETTINGS)
+    settings.update(project_data.get("extraction_settings") or {})
+    return settings
+
+
+def get_extract_options(settings: Dict) -> Dict:
+    return {key: settings[key] for key in EXTRACT_OPTION_KEYS if key in settings}
+
+
+def compute_patient_fingerprint(patient_dir: str, variables: List[Dict]) -> Optional[str]:
+    """
+    Hashes the patient's page files (names, sizes, modification times) and the
+    variable definitions, so that an unchanged patient can be recognised.
+    """
+    if not os.path.isdir(patient_dir):
+        return None
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(patient_dir)):
+        if not name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        stat = os.stat(os.path.join(patient_dir, name))
+        digest.update(f"{name}|{stat.st_size}|{stat.st_mtime_ns}\n".encode("utf-8"))
+    digest.update(json.dumps(variables, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def needs_extraction(patient: Dict, variables: List[Dict], extracted_data: Dict) -> bool:
+    """
+    True when the patient has never been extracted, ended with an error, or
+    its pages or the variable definitions changed since the stored result.
+    """
+    entry = extracted_data.get(os.path.basename(patient['patient_dir']))
+    if not entry or entry.get("error") or entry.get("data", {}).get("errors"):
+        return True
+    fingerprint = entry.get("fingerprint")
+    return fingerprint is None or fingerprint != compute_patient_fingerprint(patient['patient_dir'], variables)
+
+
+def select_patients_to_extract(patients: List[Dict], variables: List[Dict], extracted_data: Dict) -> List[Dict]:
+    return [p for p in patients if needs_extraction(p, variables, extracted_data)]
+
+
+def extract_patient(patient: Dict, variables: List[Dict], extract_fn: Callable,
+                    extract_options: Optional[Dict] = None, metrics_log: Optional[MetricsLog] = None) -> Dict:
+    """
+    Runs the extraction for one patient and wraps the result in the
+    entry format stored in project_data["extracted_data"]. Stage timings and
+    counters of the patient go to metrics_log.
+    """
+    patient_path = patient['patient_dir']
+    with patient_metrics(os.path.basename(patient_path)) as metrics:
+        try:
+            if not os.path.exists(patient_path):
+                raise FileNotFoundError(f"Dossier patient non trouvé : {patient_path}")
+
+            # Fingerprint taken before extraction: pages modified during the call are picked up next run
+            fingerprint = compute_patient_fingerprint(patient_path, variables)
+            result = extract_fn(patient_path, variables, **(extract_options or {}))
+            entry = {"data": result, "error": None, "fingerprint": fingerprint}
+        except Exception as e:
+            entry = {"data": {"variables": {}, "errors": [str(e)]}, "error": str(e), "fingerprint": None}
+    if metrics_log is not None:
+        record = metrics.to_dict()
+        record["error"] = entry["error"]
+        metrics_log.write(record)
+    return entry
+
+
+def order_by_questionnaire(extracted_data: Dict, patients: List[Dict]) -> Dict:
+    """
+    Results are stored as they complete; returns them in questionnaire order,
+    followed by any entry whose folder is no longer listed.
+    """
+    ordered = {}
+    for patient in patients:
+        patient_id = os.path.basename(patient['patient_dir'])
+        if patient_id in extracted_data:
+            ordered[patient_id] = extracted_data[patient_id]
+    for patient_id, entry in extracted_data.items():
+        ordered.setdefault(patient_id, entry)
+    return ordered
+
+
+class ExtractionEngine:
+    """
+    Extracts several patients at the same time with a bounded number of
+    in-flight requests. Results are delivered as soon as they complete, on the
+    thread that called run().
+    """
+
+    def __init__(self, extract_fn: Callable, variables: List[Dict], max_workers: int = DEFAULT_MAX_WORKERS,
+                 extract_options: Optional[Dict] = None, metrics_log: Optional[MetricsLog] = None):
+        self.extract_fn = extract_fn
+        self.variables = variables
+        self.extract_options = extract_options or {}
+        self.metrics_log = metrics_log
+        self.max_workers = max(1, min(int(max_workers), MAX_WORKERS_LIMIT))
+
+    def run(self, patients: List[Dict],
+            on_result: Optional[Callable[[int, str, Dict], None]] = None,
+            should_cancel: Optional[Callable[[], bool]] = None,
+            on_idle: Optional[Callable[[], None]] = None) -> Dict:
+        """
+        Processes the patients and calls on_result(index, patient_id, entry) as
+        each one finishes, whatever its position; index is the patient's
+        position in the list. on_idle is called while waiting, so a GUI can
+        keep processing its events. When cancelled or interrupted, results
+        that already completed are still delivered.
+        """
+        summary = {"processed": 0, "errors": 0, "cancelled": False}
+        window = self.max_workers * 2
+        in_flight = {}
+        next_index = 0
+        finished = False
+        # Scoped to this run: cancelling it never affects an import or a later run
+        cancel_event = threading.Event()
+        extract = run_cancellable(extract_patient, cancel_event)
+
+        def deliver(future):
+            index, patient = in_flight.pop(future)
+            entry = future.result()
+            if entry["error"]:
+                summary["errors"] += 1
+            else:
+                summary["processed"] += 1
+            if on_result:
+                on_result(index, os.path.basename(patient['patient_dir']), entry)
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="extraction")
+        try:
+            while next_index < len(patients) or in_flight:
+                # Refilled whenever any patient completes: a slow one never leaves workers idle
+                while next_index < len(patients) and len(in_flight) < window:
+                    patient = patients[next_index]
+                    future = executor.submit(extract, patient, self.variables, self.extract_fn,
+                                             self.extract_options, self.metrics_log)
+                    in_flight[future] = (next_index, patient)
+                    next_index += 1
+
+                if should_cancel and should_cancel():
+                    summary["cancelled"] = True
+                    return summary
+                done, _ = wait(in_flight, timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED)
+                if not done and on_idle:
+                    on_idle()
+                for future in sorted(done, key=lambda f: in_flight[f][0]):
+                    deliver(future)
+            finished = True
+        except KeyboardInterrupt:
+            summary["cancelled"] = True
+            raise
+        finally:
+            if not finished:
+                # Cancelled or interrupted: workers paused for resources must not outlive the run
+                cancel_run(cancel_event)
+                # Completed patients are kept, their model calls are already paid for
+                for future in sorted((f for f in in_flight if f.done() and not f.cancelled()),
+                                     key=lambda f: in_flight[f][0]):
+                    deliver(future)
+            executor.shutdown(wait=finished, cancel_futures=True)
+
+        return summary
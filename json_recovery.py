@@ -0,0 +1,126 @@
+import re
+import json
+from typing import Dict, List, Optional, Tuple
+
+# Constants
+REPAIR_TRAILING_COMMAS = "virgules en trop"
+REPAIR_TRUNCATED = "réponse tronquée"
+REPAIR_SALVAGED = "paires clé/valeur récupérées une à une"
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = re.compile(r'\s*')
+
+
+def _remove_trailing_commas(text: str) -> str:
+    """
+    Drops the commas directly followed by a closing brace or bracket,
+    leaving string contents untouched.
+    """
+    out = []
+    in_string = False
+    escaped = False
+    for i, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == ",":
+            j = i + 1
+            while j < len(text) and text[j].isspace():
+                j += 1
+            if j < len(text) and text[j] in "}]":
+                continue
+        out.append(char)
+    return "".join(out)
+
+
+def _skip(text: str, pos: int, separators: str = "") -> int:
+    while pos < len(text) and (text[pos].isspace() or text[pos] in separators):
+        pos += 1
+    return pos
+
+
+def _salvage_pairs(text: str, start: int) -> Tuple[Dict, bool]:
+    """
+    Reads the object at start one key/value pair at a time and keeps every
+    complete pair. Returns (pairs, closed); closed is False when the text
+    stops before the object's closing brace.
+    """
+    pairs = {}
+    pos = start + 1
+    while True:
+        pos = _skip(text, pos, ",")
+        if pos >= len(text):
+            return pairs, False
+        if text[pos] == "}":
+            return pairs, True
+        if text[pos] != '"':
+            return pairs, False
+        try:
+            key, pos = _decoder.raw_decode(text, pos)
+            pos = _skip(text, pos)
+            if pos >= len(text) or text[pos] != ":":
+                return pairs, False
+            value, pos = _decoder.raw_decode(text, _skip(text, pos + 1))
+        except json.JSONDecodeError:
+            return pairs, False
+        pairs[key] = value
+
+
+def recover_json_object(text: str) -> Tuple[Optional[Dict], List[str]]:
+    """
+    Parses the first JSON object of a model response, repairing what can be:
+    trailing commas, missing commas between pairs, and output cut off
+    before the end (every complete pair is kept). Returns (object or None,
+    repairs applied).
+    """
+    if not text:
+        return None, []
+    start = text.find("{")
+    if start < 0:
+        return None, []
+    try:
+        data, _ = _decoder.raw_decode(text, start)
+        if isinstance(data, dict):
+            return data, []
+    except json.JSONDecodeError:
+        pass
+
+    repairs = []
+    cleaned = _remove_trailing_commas(text[start:])
+    if cleaned != text[start:]:
+        repairs.append(REPAIR_TRAILING_COMMAS)
+        try:
+            data, _ = _decoder.raw_decode(cleaned)
+            if isinstance(data, dict):
+                return data, repairs
+        except json.JSONDecodeError:
+            pass
+
+    pairs, closed = _salvage_pairs(cleaned, 0)
+    repairs.append(REPAIR_SALVAGED if closed else REPAIR_TRUNCATED)
+    if not pairs:
+        return None, repairs
+    return pairs, repairs
+
+
+def recover_json_response(text: str, expected_keys: Optional[List[str]] = None) -> Dict:
+    """
+    Recovers the JSON object of a response and reports, against the keys
+    that were asked for (compared case-insensitively):
+    {"data", "repairs", "recovered_keys", "missing_keys"}.
+    """
+    data, repairs = recover_json_object(text)
+    present = {key.lower() for key in (data or {})}
+    missing = [key for key in (expected_keys or []) if key.lower() not in present]
+    return {
+        "data": data,
+        "repairs": repairs,
+        "recovered_keys": list(data.keys()) if data and repairs else [],
+        "missing_keys": missing,
+    }
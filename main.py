@@ -1,9 +1,7 @@
 import sys
 import os
-import json
 import gc
 import psutil
-import pandas as pd
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout,
     QHBoxLayout, QAction, QToolBar, QStatusBar,
@@ -15,6 +13,12 @@ from PyQt5.QtWidgets import (QDialog, QVBoxLayout, QTextEdit, QDialogButtonBox)
 from PyQt5 import QtGui
 from PyQt5.QtGui import QFont
 from PyQt5.QtCore import QSize, Qt, QTimer
+from extraction_engine import ExtractionEngine, get_extraction_settings, get_extract_options, \
+    select_patients_to_extract, order_by_questionnaire
+from settings_dialog import ExtractionSettingsDialog
+from project_store import open_project_store, new_project_data, is_project_folder
+from metrics import open_run_log, format_summary
+from exporter import ExportJob, EXPORT_FORMATS, export_format_for_path, load_export_state
 
 # These imports are from the original script.
 # As I don't have the files, I'll assume they exist and work as intended.
@@ -23,7 +27,8 @@ try:
     from documents_view import DocumentsView
     from variables_view import VariablesView
     from verification_view import VerificationView
-    from ocr import extract_data_from_image_folder, prepare_patient_folders
+    from ocr import extract_data_from_image_folder, prepare_patient_folders, configure_from_settings, \
+        compare_image_codecs, prompt_size_report, format_prompt_report
 except ImportError:
     # If the view files are not found, create dummy classes to allow the app to run
     # This is for development and testing purposes without the full project structure.
@@ -50,7 +55,7 @@ except ImportError:
 
 
     class VerificationView(QWidget):
-        def __init__(self, project_data, save_callback):
+        def __init__(self, project_data, save_callback, response_loader=None):
             super().__init__()
             self.layout = QVBoxLayout(self)
             self.label = QLabel("Vue de Vérification (Fichier manquant)")
@@ -60,12 +65,12 @@ except ImportError:
             pass
 
 
-    def extract_data_from_image_folder(path, vars):
+    def extract_data_from_image_folder(path, vars, **options):
         print(f"INFO: Appel factice de extract_data_from_image_folder pour {path}")
         return {"variables": {v['name']: "dummy_value" for v in vars}, "errors": []}
 
 
-    def prepare_patient_folders(source, output, pages):
+    def prepare_patient_folders(source, output, pages, **options):
         print(f"INFO: Appel factice de prepare_patient_folders")
         # Create some dummy patient folders for testing
         patients = []
@@ -79,6 +84,26 @@ except ImportError:
             patients.append({'patient_dir': patient_dir})
         return patients
 
+
+    def configure_from_settings(settings, project_path=None):
+        pass
+
+
+    def compare_image_codecs(folder_paths, codecs=None, merge_mode=None):
+        return []
+
+
+    def prompt_size_report(variables, variable_chunk_size=0):
+        return {}
+
+
+    def format_prompt_report(report):
+        return ""
+
+
+CODEC_SAMPLE_SIZE = 3  # patients used by the image codec comparison
+
+
 class CustomMessageBox(QMessageBox):
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -122,13 +147,8 @@ class MainWindow(QMainWindow):
 
         # --- Données du projet ---
         self.project_path = None
-        self.project_data = {
-            'scans_source_dir': None,
-            'extracted_data': {},
-            'variables': [],
-            'pages_per_questionnaire': 1,
-            'compiled_questionnaires': []
-        }
+        self.project_store = None
+        self.project_data = new_project_data()
 
         self.setWindowTitle("AutoQuest")
         self.setGeometry(100, 100, 1280, 800)
@@ -337,7 +357,8 @@ class MainWindow(QMainWindow):
         self.central_widget.addWidget(self.variables_view)
 
         # Vue Vérification
-        self.verification_view = VerificationView(self.project_data, self.save_project_data)
+        self.verification_view = VerificationView(self.project_data, self._save_extracted_value,
+                                                  self._load_raw_responses)
         self.central_widget.addWidget(self.verification_view)
 
         # Vue Exportation
@@ -369,7 +390,7 @@ class MainWindow(QMainWindow):
 
         self.save_action = QAction("&Enregistrer", self)
         self.save_action.setShortcut("Ctrl+S")
-        self.save_action.triggered.connect(self._save_project_data)
+        self.save_action.triggered.connect(lambda: self._save_project_data())
         self.save_action.setEnabled(False)
         file_menu.addAction(self.save_action)
         file_menu.addSeparator()
@@ -397,9 +418,25 @@ class MainWindow(QMainWindow):
         self.extract_action.setEnabled(False)
         tools_menu.addAction(self.extract_action)
 
-        self.export_action = QAction("&Exporter vers Excel...", self)
+        self.extract_changed_action = QAction("Extraire uniquement les nouveaux ou &modifiés", self)
+        self.extract_changed_action.setShortcut("Ctrl+Shift+R")
+        self.extract_changed_action.triggered.connect(lambda: self.safe_extract_data(only_changed=True))
+        self.extract_changed_action.setEnabled(False)
+        tools_menu.addAction(self.extract_changed_action)
+
+        self.settings_action = QAction("&Paramètres d'extraction...", self)
+        self.settings_action.triggered.connect(self.show_extraction_settings)
+        self.settings_action.setEnabled(False)
+        tools_menu.addAction(self.settings_action)
+
+        self.compare_codecs_action = QAction("&Comparer les formats d'image...", self)
+        self.compare_codecs_action.triggered.connect(self.show_codec_comparison)
+        self.compare_codecs_action.setEnabled(False)
+        tools_menu.addAction(self.compare_codecs_action)
+
+        self.export_action = QAction("&Exporter les données...", self)
         self.export_action.setShortcut("Ctrl+Shift+E")
-        self.export_action.triggered.connect(self.safe_export_to_excel)
+        self.export_action.triggered.connect(self.safe_export_data)
         self.export_action.setEnabled(False)
         tools_menu.addAction(self.export_action)
 
@@ -446,6 +483,7 @@ class MainWindow(QMainWindow):
             <ul>
                 <li>Extraire les valeurs pour toutes les variables définies</li>
                 <li>Les résultats apparaissent dans l'onglet Vérification</li>
+                <li><b>Outils > Extraire uniquement les nouveaux ou modifiés</b> : ne retraite que les patients ajoutés, modifiés ou en erreur</li>
             </ul>
 
             <h2>5. Vérification et correction</h2>
@@ -458,7 +496,8 @@ class MainWindow(QMainWindow):
             </ul>
 
             <h2>6. Exportation des résultats</h2>
-            <p>Utilisez <b>Outils > Exporter vers Excel</b> pour sauvegarder les données dans un fichier Excel.</p>
+            <p>Utilisez <b>Outils > Exporter les données</b> pour sauvegarder les données dans un fichier Excel, CSV ou Parquet.
+            Lors d'une nouvelle exportation vers le même fichier, seuls les patients nouveaux ou modifiés peuvent être exportés, dans un fichier daté placé à côté du premier.</p>
 
             <h2>Conseils</h2>
             <ul>
@@ -529,16 +568,9 @@ class MainWindow(QMainWindow):
             os.makedirs(os.path.join(project_folder, "patients"), exist_ok=True)
             os.makedirs(os.path.join(project_folder, "exports"), exist_ok=True)
 
-            project_data = {
-                'scans_source_dir': None,
-                'extracted_data': {},
-                'variables': [],
-                'pages_per_questionnaire': 1,
-                'compiled_questionnaires': []
-            }
-
-            with open(os.path.join(project_folder, "project.json"), 'w', encoding='utf-8') as f:
-                json.dump(project_data, f, indent=4)
+            store = open_project_store(project_folder)
+            store.save(new_project_data())
+            store.close()
 
             self.load_project(project_folder)
         except Exception as e:
@@ -550,12 +582,11 @@ class MainWindow(QMainWindow):
         try:
             path = QFileDialog.getExistingDirectory(self, "Ouvrir un projet", os.path.expanduser("~"))
             if path:
-                project_file = os.path.join(path, "project.json")
-                if os.path.exists(project_file):
+                if is_project_folder(path):
                     self.load_project(path)
                 else:
                     CustomMessageBox.warning(self, "Projet invalide",
-                                        "Le dossier sélectionné ne contient pas de fichier 'project.json' valide.")
+                                        "Le dossier sélectionné ne contient pas de projet AutoQuest valide.")
         except Exception as e:
             CustomMessageBox.critical(self, "Erreur", f"Échec de l'ouverture du projet :\n{str(e)}")
         finally:
@@ -571,6 +602,7 @@ class MainWindow(QMainWindow):
 
             self.project_path = path
             self._load_project_data()
+            self._apply_extraction_settings()
             self.setWindowTitle(f"AutoQuest - {os.path.basename(path)}")
             self.statusBar().showMessage(f"Projet chargé : {path}")
 
@@ -578,6 +610,9 @@ class MainWindow(QMainWindow):
             self.save_action.setEnabled(True)
             self.import_action.setEnabled(True)
             self.extract_action.setEnabled(True)
+            self.extract_changed_action.setEnabled(True)
+            self.settings_action.setEnabled(True)
+            self.compare_codecs_action.setEnabled(True)
             self.export_action.setEnabled(True)
 
             self.project_label.setText(f"Dossier du projet : {os.path.basename(path)}")
@@ -594,22 +629,37 @@ class MainWindow(QMainWindow):
             gc.collect()
 
     def _load_project_data(self):
-        path = os.path.join(self.project_path, "project.json")
-        if os.path.exists(path):
-            with open(path, 'r', encoding='utf-8') as f:
-                self.project_data = json.load(f)
+        if self.project_store:
+            self.project_store.close()
+        self.project_store = open_project_store(self.project_path)
+        self.project_data = self.project_store.load()
 
-    def _save_project_data(self):
-        if not self.project_path:
+    def _apply_extraction_settings(self):
+        configure_from_settings(get_extraction_settings(self.project_data), self.project_path)
+
+    def _save_project_data(self, include_extractions=False):
+        # Extraction results and edits are stored row by row as they happen
+        if not self.project_store:
             return
         try:
-            path = os.path.join(self.project_path, "project.json")
-            with open(path, 'w', encoding='utf-8') as f:
-                json.dump(self.project_data, f, indent=4)
+            self.project_store.save(self.project_data, include_extractions=include_extractions)
             self.statusBar().showMessage("Projet enregistré avec succès.", 3000)
         except Exception as e:
             CustomMessageBox.critical(self, "Erreur de sauvegarde", f"Échec de la sauvegarde du projet :\n{str(e)}")
 
+    def _save_extracted_value(self, patient_id, variable, value):
+        if not self.project_store:
+            return
+        try:
+            self.project_store.update_value(patient_id, variable, value)
+        except Exception as e:
+            CustomMessageBox.critical(self, "Erreur de sauvegarde", f"Échec de l'enregistrement de la valeur :\n{str(e)}")
+
+    def _load_raw_responses(self, patient_id):
+        if not self.project_store:
+            return []
+        return self.project_store.responses.get(patient_id)
+
     def safe_import_scans(self):
         if not self.project_path:
             return
@@ -638,18 +688,23 @@ class MainWindow(QMainWindow):
             self.project_data['pages_per_questionnaire'] = pages_per_q
 
             output_dir = os.path.join(self.project_path, "patients")
-            progress.setValue(20)
-            QApplication.processEvents()
+            settings = get_extraction_settings(self.project_data)
+
+            def on_file_imported(done, total):
+                progress.setMaximum(total)
+                progress.setValue(done)
+                progress.setLabelText(f"Organisation des scans... ({done}/{total})")
+                QApplication.processEvents()
 
             try:
                 self.project_data['compiled_questionnaires'] = prepare_patient_folders(
-                    source_dir, output_dir, pages_per_q)
+                    source_dir, output_dir, pages_per_q, import_mode=settings["import_mode"],
+                    progress_callback=on_file_imported)
 
-                progress.setValue(80)
                 self.documents_view.update_view(self.project_data)
                 self._save_project_data()
 
-                progress.setValue(100)
+                progress.setValue(progress.maximum())
                 CustomMessageBox.information(self, "Importation réussie",
                                         f"{len(self.project_data['compiled_questionnaires'])} dossiers patient ont été préparés.")
             except Exception as e:
@@ -663,7 +718,7 @@ class MainWindow(QMainWindow):
         finally:
             gc.collect()
 
-    def safe_extract_data(self):
+    def safe_extract_data(self, only_changed=False):
         if not self.project_data.get("compiled_questionnaires"):
             CustomMessageBox.warning(self, "Données manquantes", "Veuillez d'abord importer et organiser les scans.")
             return
@@ -674,58 +729,59 @@ class MainWindow(QMainWindow):
                                 "Veuillez définir des variables avant de lancer l'extraction.")
             return
 
-        total_patients = len(self.project_data['compiled_questionnaires'])
+        patients = self.project_data['compiled_questionnaires']
+        if only_changed:
+            patients = select_patients_to_extract(patients, variables, self.project_data.get("extracted_data", {}))
+            if not patients:
+                CustomMessageBox.information(self, "Extraction à jour",
+                                             "Aucun patient nouveau, modifié ou en erreur à traiter.")
+                return
+        total_patients = len(patients)
+        settings = get_extraction_settings(self.project_data)
         progress = QProgressDialog("Extraction des données en cours...", "Annuler", 0, total_patients, self)
         progress.setWindowModality(Qt.WindowModal)
         progress.setValue(0)
         QApplication.processEvents()
 
         try:
-            extracted_data = self.project_data.get("extracted_data", {})
-            processed_count = 0
-            error_count = 0
-
-            for i, patient in enumerate(self.project_data['compiled_questionnaires']):
-                if progress.wasCanceled():
-                    break
-
-                progress.setValue(i)
-                patient_id = os.path.basename(patient['patient_dir'])
-                progress.setLabelText(f"Traitement du patient : {patient_id}...")
-                QApplication.processEvents()
-
-                try:
-                    patient_path = patient['patient_dir']
-                    if not os.path.exists(patient_path):
-                        raise FileNotFoundError(f"Dossier patient non trouvé : {patient_path}")
-
-                    result = extract_data_from_image_folder(patient_path, variables)
-                    extracted_data[patient_id] = {
-                        "data": result,
-                        "error": None
-                    }
-                    processed_count += 1
-
-                except Exception as e:
-                    error_count += 1
-                    extracted_data[patient_id] = {
-                        "data": {"variables": {}, "errors": [str(e)]},
-                        "error": str(e)
-                    }
-
-                if i % 5 == 0:
+            extracted_data = self.project_data.setdefault("extracted_data", {})
+            print(format_prompt_report(prompt_size_report(variables, settings["variable_chunk_size"])))
+
+            completed = {"count": 0}
+
+            def on_result(index, patient_id, entry):
+                extracted_data[patient_id] = entry
+                self.project_store.save_extraction(patient_id, entry)
+                completed["count"] += 1
+                progress.setValue(completed["count"])
+                progress.setLabelText(f"Patient terminé : {patient_id} ({completed['count']}/{total_patients})")
+                if completed["count"] % 5 == 0:
                     gc.collect()
 
-            self.project_data["extracted_data"] = extracted_data
-            self._save_project_data()
+            metrics_log = open_run_log(self.project_path)
+            self.project_store.responses.start_run()
+            engine = ExtractionEngine(extract_data_from_image_folder, variables,
+                                      max_workers=settings["max_workers"],
+                                      extract_options=get_extract_options(settings),
+                                      metrics_log=metrics_log)
+            try:
+                summary = engine.run(patients, on_result=on_result,
+                                     should_cancel=progress.wasCanceled,
+                                     on_idle=QApplication.processEvents)
+            finally:
+                run_metrics = metrics_log.close()
+                self.project_store.responses.end_run()
 
+            self.project_data["extracted_data"] = order_by_questionnaire(
+                extracted_data, self.project_data['compiled_questionnaires'])
             self.verification_view.update_view(self.project_data)
 
             progress.setValue(total_patients)
             CustomMessageBox.information(
                 self,
                 "Extraction terminée",
-                f"Traitement terminé.\nPatients traités : {processed_count}\nPatients en erreur : {error_count}"
+                f"Traitement terminé.\nPatients traités : {summary['processed']}\nPatients en erreur : {summary['errors']}"
+                f"\n\n{format_summary(run_metrics)}"
             )
 
         except Exception as e:
@@ -735,6 +791,61 @@ class MainWindow(QMainWindow):
             progress.close()
             gc.collect()
 
+    def show_extraction_settings(self):
+        dialog = ExtractionSettingsDialog(self.project_data, self)
+        if dialog.exec_():
+            self.project_data['extraction_settings'] = dialog.get_settings()
+            self._apply_extraction_settings()
+            self._save_project_data()
+
+    def show_codec_comparison(self):
+        """Compare payload size and encode time of each image codec on a sample of the project's scans"""
+        patients = self.project_data.get('compiled_questionnaires', [])
+        sample_dirs = [p['patient_dir'] for p in patients[:CODEC_SAMPLE_SIZE] if os.path.isdir(p['patient_dir'])]
+        if not sample_dirs:
+            CustomMessageBox.warning(self, "Données manquantes", "Veuillez d'abord importer et organiser les scans.")
+            return
+
+        settings = get_extraction_settings(self.project_data)
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            report = compare_image_codecs(sample_dirs, merge_mode=settings["merge_mode"])
+        except Exception as e:
+            CustomMessageBox.critical(self, "Erreur", f"Échec de la comparaison des formats :\n{str(e)}")
+            return
+        finally:
+            QApplication.restoreOverrideCursor()
+
+        rows = []
+        for entry in report:
+            codec = entry["format"] if entry["quality"] is None else f"{entry['format']} (qualité {entry['quality']})"
+            if entry["error"]:
+                rows.append(f"<tr><td>{codec}</td><td colspan='3'>Non disponible : {entry['error']}</td></tr>")
+            else:
+                rows.append(f"<tr><td>{codec}</td><td>{entry['avg_bytes'] / 1024:.0f} Ko</td>"
+                            f"<td>{entry['avg_base64_bytes'] / 1024:.0f} Ko</td><td>{entry['avg_encode_ms']} ms</td></tr>")
+        html = f"""
+            <h2>Comparaison des formats d'image</h2>
+            <p>Moyenne sur {len(sample_dirs)} patient(s). Format actuel : <b>{settings['image_format']}</b>.</p>
+            <table cellpadding="6" border="1" style="border-collapse: collapse;">
+                <tr><th>Format</th><th>Taille</th><th>Taille envoyée (base64)</th><th>Encodage</th></tr>
+                {''.join(rows)}
+            </table>
+            """
+
+        dialog = QDialog(self)
+        dialog.setWindowTitle("Comparaison des formats d'image")
+        dialog.resize(700, 420)
+        layout = QVBoxLayout(dialog)
+        text_edit = QTextEdit()
+        text_edit.setReadOnly(True)
+        text_edit.setHtml(html)
+        layout.addWidget(text_edit)
+        buttons = QDialogButtonBox(QDialogButtonBox.Close)
+        buttons.rejected.connect(dialog.reject)
+        layout.addWidget(buttons)
+        dialog.exec_()
+
     def show_info(self, title, message):
         msg = CustomMessageBox(self)
         msg.setWindowTitle(title)
@@ -756,7 +867,7 @@ class MainWindow(QMainWindow):
         msg.setIcon(CustomMessageBox.Critical)
         msg.exec_()
 
-    def safe_export_to_excel(self):
+    def safe_export_data(self):
         if not self.project_path:
             return
 
@@ -766,43 +877,57 @@ class MainWindow(QMainWindow):
             return
 
         default_path = os.path.join(self.project_path, "exports", "donnees_extraites.xlsx")
-        excel_path, _ = QFileDialog.getSaveFileName(self, "Exporter vers Excel", default_path,
-                                                    "Fichiers Excel (*.xlsx)")
+        export_path, _ = QFileDialog.getSaveFileName(self, "Exporter les données", default_path,
+                                                     ";;".join(label for _, label in EXPORT_FORMATS))
 
-        if not excel_path:
+        if not export_path:
             return
 
         try:
-            progress = QProgressDialog("Exportation vers Excel...", "Annuler", 0, 100, self)
-            progress.setWindowModality(Qt.WindowModal)
-            progress.setValue(10)
-            QApplication.processEvents()
+            fmt = export_format_for_path(export_path)
+        except ValueError as e:
+            CustomMessageBox.warning(self, "Format non pris en charge", str(e))
+            return
 
-            rows = []
-            for patient_id, result in data_dict.items():
-                if progress.wasCanceled():
-                    return
-                row = {"Patient": patient_id}
-                if result.get('data') and result['data'].get('variables'):
-                    row.update(result['data']['variables'])
-                rows.append(row)
+        only_changed = False
+        if load_export_state(export_path):
+            reply = CustomMessageBox.question(
+                self, "Exportation incrémentale",
+                "Ce fichier a déjà été exporté.\nN'exporter que les patients nouveaux ou modifiés depuis ?",
+                CustomMessageBox.Yes | CustomMessageBox.No, CustomMessageBox.Yes)
+            only_changed = reply == CustomMessageBox.Yes
 
-            progress.setValue(50)
-            QApplication.processEvents()
+        progress = QProgressDialog("Exportation des données...", "Annuler", 0, len(data_dict), self)
+        progress.setWindowModality(Qt.WindowModal)
+        progress.setValue(0)
+        QApplication.processEvents()
 
-            df = pd.DataFrame(rows)
-            df.to_excel(excel_path, index=False, engine='openpyxl')
+        try:
+            def on_progress(done, total):
+                progress.setMaximum(total)
+                progress.setValue(done)
+                progress.setLabelText(f"Exportation des données... ({done}/{total})")
+
+            job = ExportJob(data_dict, self.project_data.get('variables', []), export_path, fmt,
+                            only_changed=only_changed)
+            summary = job.run(on_progress=on_progress, should_cancel=progress.wasCanceled,
+                              on_idle=QApplication.processEvents)
+            if summary is None:
+                self.statusBar().showMessage("Exportation annulée.", 5000)
+                return
+            if not summary['path']:
+                CustomMessageBox.information(self, "Exportation à jour",
+                                             "Aucun patient nouveau ou modifié depuis la dernière exportation.")
+                return
 
-            progress.setValue(100)
             CustomMessageBox.information(self, "Exportation réussie",
-                                    f"Les données ont été exportées avec succès vers :\n{excel_path}")
-            self.statusBar().showMessage(f"Exporté vers {excel_path}", 5000)
+                                    f"{summary['rows']} ligne(s) exportée(s) vers :\n{summary['path']}")
+            self.statusBar().showMessage(f"Exporté vers {summary['path']}", 5000)
 
         except Exception as e:
-            CustomMessageBox.critical(self, "Erreur d'exportation", f"Échec de l'exportation vers Excel :\n{str(e)}")
+            CustomMessageBox.critical(self, "Erreur d'exportation", f"Échec de l'exportation des données :\n{str(e)}")
         finally:
-            if 'progress' in locals() and isinstance(progress, QProgressDialog):
-                progress.close()
+            progress.close()
             gc.collect()
 
     def closeEvent(self, event):
@@ -811,6 +936,8 @@ class MainWindow(QMainWindow):
 
         if reply == CustomMessageBox.Yes:
             self.memory_timer.stop()
+            if self.project_store:
+                self.project_store.close()
             gc.collect()
             event.accept()
         else:
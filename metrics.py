@@ -0,0 +1,226 @@
+import os
+import json
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from time import perf_counter
+from typing import Callable, Dict, List, Optional
+
+# Constants
+METRICS_DIR = "metrics"
+STAGES = ("merge", "preprocess", "base64", "ttfb", "http", "parse", "consolidate")
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """
+    Nearest-rank percentile; 0.0 for an empty list.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+class PatientMetrics:
+    """
+    Stage timings and counters of one patient. Shared by the threads working
+    on that patient, hence the lock.
+    """
+
+    def __init__(self, patient_id: str):
+        self.patient_id = patient_id
+        self.started = perf_counter()
+        self.total_seconds = 0.0
+        self.stages = {}
+        self.counters = {}
+        self.image_sizes = []
+        self._lock = threading.Lock()
+
+    def add_time(self, stage_name: str, seconds: float):
+        with self._lock:
+            self.stages[stage_name] = self.stages.get(stage_name, 0.0) + seconds
+
+    def count(self, name: str, value: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_image_size(self, size: tuple):
+        with self._lock:
+            self.image_sizes.append(list(size))
+
+    def finish(self):
+        self.total_seconds = perf_counter() - self.started
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                "type": "patient",
+                "patient_id": self.patient_id,
+                "total_ms": round(self.total_seconds * 1000, 1),
+                # Cumulative per stage: concurrent requests can add up to more than total_ms
+                "stages_ms": {name: round(seconds * 1000, 1) for name, seconds in self.stages.items()},
+                "counters": dict(self.counters),
+                "image_sizes": list(self.image_sizes),
+            }
+
+
+_local = threading.local()
+
+
+def current_metrics() -> Optional[PatientMetrics]:
+    return getattr(_local, "metrics", None)
+
+
+@contextmanager
+def patient_metrics(patient_id: str):
+    """
+    Makes a fresh PatientMetrics the current one for this thread.
+    """
+    metrics = PatientMetrics(patient_id)
+    previous = current_metrics()
+    _local.metrics = metrics
+    try:
+        yield metrics
+    finally:
+        metrics.finish()
+        _local.metrics = previous
+
+
+def bind_metrics(fn: Callable) -> Callable:
+    """
+    Wraps fn so that, run on a pool thread, it records into the caller's metrics.
+    """
+    metrics = current_metrics()
+    if metrics is None:
+        return fn
+
+    def bound(*args, **kwargs):
+        previous = current_metrics()
+        _local.metrics = metrics
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.metrics = previous
+    return bound
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Times a block into the current patient's metrics; a no-op outside a patient.
+    """
+    metrics = current_metrics()
+    if metrics is None:
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_time(name, perf_counter() - start)
+
+
+def record_time(name: str, seconds: float):
+    """
+    Adds a duration measured elsewhere, e.g. the time to first byte.
+    """
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics.add_time(name, seconds)
+
+
+def count(name: str, value: int = 1):
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics.count(name, value)
+
+
+def record_image_size(size: tuple):
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics.add_image_size(size)
+
+
+def summarize(records: List[Dict], wall_seconds: float) -> Dict:
+    """
+    Throughput, latency percentiles and per-stage medians of a run.
+    """
+    latencies = [r["total_ms"] for r in records]
+    counters = {}
+    for r in records:
+        for name, value in r.get("counters", {}).items():
+            counters[name] = counters.get(name, 0) + value
+    stage_names = sorted({name for r in records for name in r.get("stages_ms", {})},
+                         key=lambda n: STAGES.index(n) if n in STAGES else len(STAGES))
+    return {
+        "type": "summary",
+        "patients": len(records),
+        "wall_seconds": round(wall_seconds, 2),
+        "patients_per_minute": round(len(records) / wall_seconds * 60, 1) if wall_seconds > 0 else 0.0,
+        "latency_p50_ms": round(percentile(latencies, 50), 1),
+        "latency_p95_ms": round(percentile(latencies, 95), 1),
+        "stages_p50_ms": {name: round(percentile([r["stages_ms"].get(name, 0.0) for r in records], 50), 1)
+                          for name in stage_names},
+        "counters": counters,
+    }
+
+
+def format_summary(summary: Dict) -> str:
+    lines = [
+        f"Débit : {summary['patients_per_minute']} patients/min ({summary['patients']} en {summary['wall_seconds']} s)",
+        f"Latence par patient : p50 {summary['latency_p50_ms'] / 1000:.1f} s, p95 {summary['latency_p95_ms'] / 1000:.1f} s",
+    ]
+    if summary["stages_p50_ms"]:
+        lines.append("Étapes (médiane) : " + ", ".join(f"{name} {ms:.0f} ms"
+                                                        for name, ms in summary["stages_p50_ms"].items()))
+    if summary["counters"]:
+        lines.append("Compteurs : " + ", ".join(f"{name} {value}" for name, value in summary["counters"].items()))
+    return "\n".join(lines)
+
+
+class MetricsLog:
+    """
+    Collects the per-patient records of one run and appends them as JSON
+    lines to a file; close() adds the run summary as the last line.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.records = []
+        self.started = perf_counter()
+        self._lock = threading.Lock()
+        self._file = None
+        if path:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._file = open(path, 'a', encoding='utf-8')
+
+    def write(self, record: Dict):
+        with self._lock:
+            self.records.append(record)
+            if self._file:
+                self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                self._file.flush()
+
+    def summary(self) -> Dict:
+        with self._lock:
+            return summarize(list(self.records), perf_counter() - self.started)
+
+    def close(self) -> Dict:
+        summary = self.summary()
+        with self._lock:
+            if self._file:
+                self._file.write(json.dumps(summary, ensure_ascii=False) + "\n")
+                self._file.close()
+                self._file = None
+        return summary
+
+
+def open_run_log(project_path: Optional[str], name: str = "extraction") -> MetricsLog:
+    """
+    Starts a metrics file under <project>/metrics, named after the run's start time.
+    """
+    if not project_path:
+        return MetricsLog()
+    filename = f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl"
+    return MetricsLog(os.path.join(project_path, METRICS_DIR, filename))
@@ -0,0 +1,195 @@
+"""
+Local stand-in for the vision model endpoint, to exercise the extraction
+pipeline offline. Serves POST /generate and the batched POST /generate_batch,
+with configurable latency, jitter, error rate and canned replies. Requests
+with "stream": true are answered as server-sent events, token by token.
+
+    python mock_vision_server.py --port 8000 --latency-ms 800 --jitter-ms 200 --error-rate 0.02
+    python mock_vision_server.py --token-interval-ms 20 --stall-after 50
+"""
+import re
+import json
+import random
+import argparse
+import threading
+from time import sleep
+from typing import Dict, Optional
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Constants
+STREAM_CHUNK_CHARS = 8  # characters per streamed token
+STREAM_TRAILER = "\n```\nFin de la réponse."  # text generated after the JSON, never needed by the client
+STALL_DURATION = 3600  # seconds a stalled stream stays silent
+
+
+def canned_reply(prompt: str, replies: Optional[Dict] = None) -> str:
+    """
+    Answers with the JSON example embedded in the prompt: every requested key
+    takes its value from replies, or "Non renseigné", and the detection
+    example is echoed.
+    """
+    match = re.search(r'```json\s*(\{.*?\})\s*```', prompt, re.DOTALL)
+    if not match:
+        return "{}"
+    try:
+        example = json.loads(match.group(1))
+    except json.JSONDecodeError:
+        return "{}"
+    if isinstance(example.get("variables"), list):
+        return json.dumps(example, ensure_ascii=False)
+    replies = replies or {}
+    return json.dumps({key: replies.get(key, "Non renseigné") for key in example}, ensure_ascii=False)
+
+
+class MockVisionServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, replies: Optional[Dict] = None, seed: Optional[int] = None,
+                 token_interval: float = 0.0, stall_after: Optional[int] = None):
+        super().__init__((host, port), MockVisionHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.replies = replies or {}
+        self.random = random.Random(seed)
+        self.token_interval = token_interval
+        self.stall_after = stall_after  # streamed tokens sent before going silent
+        self.stats = {"requests": 0, "batches": 0, "items": 0, "errors": 0, "bytes_received": 0,
+                      "streams": 0, "stalls": 0, "streams_closed_early": 0}
+        self._stats_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/generate"
+
+    def record(self, **counts):
+        with self._stats_lock:
+            for key, value in counts.items():
+                self.stats[key] += value
+
+    def simulate_latency(self):
+        delay = self.latency + self.random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            sleep(delay)
+
+    def should_fail(self) -> bool:
+        return self.error_rate > 0 and self.random.random() < self.error_rate
+
+    def generate(self, payload: Dict) -> Dict:
+        return {"text": canned_reply(payload.get("prompt", ""), self.replies)}
+
+    def start(self) -> "MockVisionServer":
+        self._thread = threading.Thread(target=self.serve_forever, name="mock-vision-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class MockVisionHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        self.server.record(requests=1, bytes_received=length)
+        try:
+            data = json.loads(body)
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": "invalid JSON body"})
+            return
+
+        if self.path.rstrip("/") not in ("/generate", "/generate_batch"):
+            self._send_json(404, {"error": f"unknown path {self.path}"})
+            return
+
+        # One GPU pass per call, whether it carries one request or a batch
+        self.server.simulate_latency()
+        if self.server.should_fail():
+            self.server.record(errors=1)
+            self._send_json(503, {"error": "simulated failure"})
+        elif self.path.rstrip("/") == "/generate" and data.get("stream"):
+            self.server.record(items=1, streams=1)
+            self._send_stream(self.server.generate(data)["text"] + STREAM_TRAILER)
+        elif self.path.rstrip("/") == "/generate":
+            self.server.record(items=1)
+            self._send_json(200, self.server.generate(data))
+        else:
+            requests_list = data.get("requests", [])
+            self.server.record(batches=1, items=len(requests_list))
+            self._send_json(200, {"outputs": [self.server.generate(p) for p in requests_list]})
+
+    def _send_json(self, status: int, data: Dict):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self, text: str):
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        chunks = [text[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(text), STREAM_CHUNK_CHARS)]
+        try:
+            for sent, chunk in enumerate(chunks):
+                if self.server.stall_after is not None and sent >= self.server.stall_after:
+                    self.server.record(stalls=1)
+                    sleep(STALL_DURATION)
+                    return
+                event = json.dumps({"text": chunk}, ensure_ascii=False)
+                self.wfile.write(f"data: {event}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                if self.server.token_interval:
+                    sleep(self.server.token_interval)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stops reading once the JSON object is complete
+            self.server.record(streams_closed_early=1)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_mock_server(host: str = "127.0.0.1", port: int = 0, **options) -> MockVisionServer:
+    """
+    Starts the stand-in server on a background thread; port 0 picks a free port.
+    """
+    return MockVisionServer(host, port, **options).start()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serveur local simulant le modèle de vision.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency-ms", type=float, default=0, help="latence simulée par appel")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="variation aléatoire de la latence (±)")
+    parser.add_argument("--error-rate", type=float, default=0, help="proportion d'appels en erreur 503 (0 à 1)")
+    parser.add_argument("--replies", help="fichier JSON {variable: valeur} des réponses simulées")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--token-interval-ms", type=float, default=0, help="délai entre deux tokens en flux")
+    parser.add_argument("--stall-after", type=int, help="nombre de tokens envoyés avant un blocage simulé du flux")
+    args = parser.parse_args()
+
+    replies = None
+    if args.replies:
+        with open(args.replies, 'r', encoding='utf-8') as f:
+            replies = json.load(f)
+    server = MockVisionServer(args.host, args.port, latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000,
+                              error_rate=args.error_rate, replies=replies, seed=args.seed,
+                              token_interval=args.token_interval_ms / 1000, stall_after=args.stall_after)
+    print(f"🧪 Serveur de vision simulé sur {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -1,53 +1,338 @@
 import os
+import sys
 import io
 import gc
 import json
 import shutil
-import psutil
 import base64
 import re
 import requests
-from time import sleep
-from typing import List, Dict, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from functools import lru_cache
+from requests.adapters import HTTPAdapter
+from time import perf_counter
+from typing import Callable, List, Dict, Optional
 from PIL import Image, ImageFile
-import tempfile
+from response_cache import ResponseCache, DEFAULT_CACHE_MAX_BYTES
+from resource_governor import wait_for_resources, configure_resource_governor, bind_cancel_event
+from batch_transport import BatchingTransport, DEFAULT_BATCH_SIZE, DEFAULT_BATCH_MAX_WAIT
+from retry_policy import RetryPolicy, CircuitBreaker, VisionRequestError, call_with_retries
+from json_recovery import recover_json_object, recover_json_response
+from response_stream import read_streamed_json, DEFAULT_STALL_TIMEOUT
+import metrics
 
 # Constants
-MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
-MAX_RETRIES = 3
-RETRY_DELAY = 5  # seconds
+MAX_IMAGE_DIMENSION = 2000  # pixels, longest side of the image sent to the model
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+MERGE_MODE_STREAMING = "streaming"  # downscale each page before compositing
+MERGE_MODE_FULL = "full"  # composite at full resolution, then downscale
+IMAGE_FORMATS = ("PNG", "JPEG", "WEBP")
+DEFAULT_IMAGE_FORMAT = "PNG"
+DEFAULT_IMAGE_QUALITY = 85  # JPEG / WebP only
+CODEC_CANDIDATES = [("PNG", None), ("JPEG", 95), ("JPEG", 85), ("JPEG", 75), ("WEBP", 90), ("WEBP", 80)]
+EXTRACTION_MODE_MERGED = "merged"  # all pages stacked into one request
+EXTRACTION_MODE_PER_PAGE = "per_page"  # one request per page group, run concurrently
+IMPORT_MODE_AUTO = "auto"  # reflink, else hardlink, else copy
+IMPORT_MODE_COPY = "copy"
+DEFAULT_IMPORT_WORKERS = 8
+IMPORT_POLL_INTERVAL = 0.1  # seconds between two progress calls while no file completes
+FICLONE = 0x40049409  # Linux ioctl request for copy-on-write clones
 
 # API Configuration
-RUNPOD_ENDPOINT = "https://c43y94kifocpf5-8000.proxy.runpod.net/generate"
+DEFAULT_VISION_ENDPOINT = os.environ.get("AUTOQUEST_VISION_ENDPOINT",
+                                         "https://c43y94kifocpf5-8000.proxy.runpod.net/generate")
+DEFAULT_POOL_SIZE = 16
+DEFAULT_CONNECT_TIMEOUT = 10  # seconds
+DEFAULT_READ_TIMEOUT = 300  # seconds
+
+# Debug output: full raw model responses and extracted values, off unless asked for
+DEBUG_OUTPUT_FROM_ENV = os.environ.get("AUTOQUEST_DEBUG", "") not in ("", "0")
+DEBUG_OUTPUT = DEBUG_OUTPUT_FROM_ENV
 
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
 
-def check_system_resources():
-    mem = psutil.virtual_memory()
-    if mem.percent > 90:
-        raise MemoryError(f"Memory usage too high ({mem.percent}%)")
-    if psutil.cpu_percent(interval=1) > 90:
-        raise RuntimeError("CPU usage too high")
+class VisionClient:
+    """
+    Shared HTTP client for the vision endpoint. Connections are kept alive in a
+    bounded pool and reused by every request, from every worker thread.
+    """
 
+    def __init__(self, endpoint: Optional[str] = None, pool_size: int = DEFAULT_POOL_SIZE,
+                 connect_timeout: float = DEFAULT_CONNECT_TIMEOUT, read_timeout: float = DEFAULT_READ_TIMEOUT):
+        self.endpoint = endpoint
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.streaming = False
+        self.stall_timeout = DEFAULT_STALL_TIMEOUT
+        self.cache: Optional[ResponseCache] = None
+        self.retry_policy = RetryPolicy()
+        self.circuit_breaker = CircuitBreaker()
+        self.batch_endpoint: Optional[str] = None
+        self.batching: Optional[BatchingTransport] = None
+        self.stats = {"requests": 0, "bytes_sent": 0, "cache_hits": 0}
+        self._stats_lock = threading.Lock()
+        self._session = None
+        self._lock = threading.Lock()
+
+    def configure(self, endpoint: Optional[str] = None, pool_size: Optional[int] = None,
+                  connect_timeout: Optional[float] = None, read_timeout: Optional[float] = None,
+                  streaming: Optional[bool] = None, stall_timeout: Optional[float] = None):
+        with self._lock:
+            if endpoint:
+                self.endpoint = endpoint
+            if streaming is not None:
+                self.streaming = streaming
+            if stall_timeout:
+                self.stall_timeout = stall_timeout
+            if connect_timeout:
+                self.connect_timeout = connect_timeout
+            if read_timeout:
+                self.read_timeout = read_timeout
+            if pool_size and pool_size != self.pool_size:
+                self.pool_size = pool_size
+                self._close_session()
+
+    def _get_session(self) -> requests.Session:
+        with self._lock:
+            if self._session is None:
+                adapter = HTTPAdapter(
+                    pool_connections=1, pool_maxsize=self.pool_size, pool_block=True, max_retries=0)
+                session = requests.Session()
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._session = session
+            return self._session
+
+    def _close_session(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def generate(self, payload: Dict, is_valid: Optional[Callable[[str], bool]] = None) -> str:
+        """
+        Sends one payload to the endpoint and returns the generated text.
+        Responses already in the cache are returned without any request; a
+        new response is cached only if is_valid accepts it, so that a bad
+        answer is asked again on the next run instead of being replayed.
+        """
+        cache = self.cache
+        cache_key = None
+        if cache is not None:
+            cache_key = cache.make_key(payload)
+            cached_text = cache.get(cache_key)
+            if cached_text is not None:
+                self._record(cache_hits=1)
+                metrics.count("cache_hits")
+                return cached_text
+
+        batching = self.batching
+        if batching is not None:
+            # Counted here: the batch request itself is sent from the batching thread
+            metrics.count("requests")
+            metrics.count("payload_bytes", len(json.dumps(payload).encode("utf-8")))
+            text = batching.submit(payload)
+        elif self.streaming:
+            text = self._post_stream(payload)
+        else:
+            text = self._post(payload)
+        if cache is not None and text and (is_valid is None or is_valid(text)):
+            cache.put(cache_key, text)
+        return text
+
+    def _post(self, payload: Dict) -> str:
+        if not self.endpoint:
+            raise ValueError("Aucun point d'accès n'est configuré pour le modèle de vision.")
+        response = self._send(self.endpoint, payload)
+        data = response.json()
+        return data.get("text") or data.get("output", "")
+
+    def _post_stream(self, payload: Dict) -> str:
+        """
+        Streamed variant of /generate: tokens are read as they arrive and the
+        request ends as soon as the JSON object closes. The usual read timeout
+        covers the wait for the first token; once tokens flow, a stream that
+        stops producing them for stall_timeout seconds is aborted (and retried).
+        """
+        if not self.endpoint:
+            raise ValueError("Aucun point d'accès n'est configuré pour le modèle de vision.")
+        data = json.dumps(dict(payload, stream=True)).encode("utf-8")
+        self._record_sent(len(data))
+        start = perf_counter()
+        response = self._get_session().post(self.endpoint, data=data, stream=True,
+                                            headers={"Content-Type": "application/json",
+                                                     "Accept": "text/event-stream"},
+                                            timeout=(self.connect_timeout, self.read_timeout))
+        try:
+            response.raise_for_status()
+        except requests.HTTPError:
+            response.close()
+            raise
+
+        def on_first_byte():
+            metrics.record_time("ttfb", perf_counter() - start)
+
+        return read_streamed_json(response, max_duration=self.read_timeout, on_first_byte=on_first_byte,
+                                  stall_timeout=self.stall_timeout)
+
+    def _post_batch(self, payloads: List[Dict]) -> List[Dict]:
+        """
+        Sends several payloads in one request to the batch endpoint, which
+        answers {"outputs": [{"text": ...} or {"error": ...}, ...]} in order.
+        """
+        endpoint = self.batch_endpoint or (self.endpoint and self.endpoint.rstrip("/") + "_batch")
+        if not endpoint:
+            raise ValueError("Aucun point d'accès n'est configuré pour le modèle de vision.")
+        response = self._send(endpoint, {"requests": payloads})
+        return response.json()["outputs"]
+
+    def _send(self, url: str, body: Dict) -> requests.Response:
+        data = json.dumps(body).encode("utf-8")
+        self._record_sent(len(data))
+        response = self._get_session().post(url, data=data, headers={"Content-Type": "application/json"},
+                                            timeout=(self.connect_timeout, self.read_timeout))
+        response.raise_for_status()
+        return response
+
+    def _record_sent(self, size: int):
+        """
+        Counts one HTTP attempt, in the client stats and in the calling
+        patient's metrics.
+        """
+        self._record(requests=1, bytes_sent=size)
+        metrics.count("requests")
+        metrics.count("payload_bytes", size)
+
+    def _record(self, **counts):
+        with self._stats_lock:
+            for key, value in counts.items():
+                self.stats[key] += value
+
+    def reset_stats(self) -> Dict:
+        """
+        Returns the request counters and sets them back to zero.
+        """
+        with self._stats_lock:
+            stats = dict(self.stats)
+            for key in self.stats:
+                self.stats[key] = 0
+        return stats
+
+    def enable_batching(self, batch_size: int = DEFAULT_BATCH_SIZE, max_wait: float = DEFAULT_BATCH_MAX_WAIT,
+                        batch_endpoint: Optional[str] = None):
+        """
+        Packs concurrent requests into batched calls, e.g. for a vLLM-style backend.
+        """
+        self.disable_batching()
+        self.batch_endpoint = batch_endpoint
+        self.batching = BatchingTransport(self._post_batch, batch_size=batch_size, max_wait=max_wait,
+                                          max_in_flight=self.pool_size)
+
+    def disable_batching(self):
+        batching, self.batching = self.batching, None
+        if batching is not None:
+            batching.close()
+
+    def close(self):
+        self.disable_batching()
+        with self._lock:
+            self._close_session()
+
+
+_vision_client = VisionClient(DEFAULT_VISION_ENDPOINT)
+
+
+def get_vision_client() -> VisionClient:
+    return _vision_client
+
+
+def configure_vision_client(endpoint: Optional[str] = None, pool_size: Optional[int] = None,
+                            connect_timeout: Optional[float] = None, read_timeout: Optional[float] = None,
+                            streaming: Optional[bool] = None, stall_timeout: Optional[float] = None):
+    """
+    Updates the shared vision client, e.g. with the endpoint stored in the project.
+    """
+    _vision_client.configure(endpoint=endpoint, pool_size=pool_size,
+                             connect_timeout=connect_timeout, read_timeout=read_timeout,
+                             streaming=streaming, stall_timeout=stall_timeout)
+
+
+def configure_batching(enabled: bool, batch_size: int = DEFAULT_BATCH_SIZE,
+                       max_wait: float = DEFAULT_BATCH_MAX_WAIT, batch_endpoint: Optional[str] = None):
+    if enabled:
+        _vision_client.enable_batching(batch_size=batch_size, max_wait=max_wait, batch_endpoint=batch_endpoint)
+    else:
+        _vision_client.disable_batching()
+
+
+def configure_retry_policy(max_attempts: Optional[int] = None, base_delay: Optional[float] = None,
+                           max_delay: Optional[float] = None, breaker_threshold: Optional[int] = None,
+                           breaker_cooldown: Optional[float] = None):
+    policy = _vision_client.retry_policy
+    breaker = _vision_client.circuit_breaker
+    if max_attempts:
+        policy.max_attempts = max_attempts
+    if base_delay:
+        policy.base_delay = base_delay
+    if max_delay:
+        policy.max_delay = max_delay
+    if breaker_threshold:
+        breaker.failure_threshold = breaker_threshold
+    if breaker_cooldown:
+        breaker.cooldown = breaker_cooldown
+
+
+def configure_response_cache(directory: Optional[str], max_bytes: int = DEFAULT_CACHE_MAX_BYTES):
+    """
+    Puts a persistent response cache in front of the shared vision client.
+    Passing no directory disables the cache.
+    """
+    _vision_client.cache = ResponseCache(directory, max_bytes) if directory else None
 
-def validate_image_file(image_path: str) -> bool:
-    try:
-        if not os.path.exists(image_path):
-            return False
-        if os.path.getsize(image_path) > MAX_FILE_SIZE:
-            return False
-        with Image.open(image_path) as img:
-            img.verify()
-        return True
-    except Exception:
-        return False
-
-
-def safe_image_open(image_path: str) -> Optional[Image.Image]:
-    check_system_resources()
+
+def set_debug_output(enabled: bool):
+    global DEBUG_OUTPUT
+    DEBUG_OUTPUT = bool(enabled)
+
+
+def configure_from_settings(settings: Dict, project_path: Optional[str] = None):
+    """
+    Applies a project's extraction settings (see get_extraction_settings) to the
+    shared client and the resource governor, for the GUI and the CLI alike.
+    """
+    configure_vision_client(endpoint=settings["vision_endpoint"] or None,
+                            pool_size=settings["pool_size"],
+                            connect_timeout=settings["connect_timeout"],
+                            read_timeout=settings["read_timeout"],
+                            streaming=settings["streaming_enabled"],
+                            stall_timeout=settings["stall_timeout"])
+    configure_batching(settings["batching_enabled"], batch_size=settings["batch_size"],
+                       max_wait=settings["batch_max_wait_ms"] / 1000,
+                       batch_endpoint=settings["batch_endpoint"] or None)
+    configure_retry_policy(max_attempts=settings["max_attempts"],
+                           base_delay=settings["retry_base_delay"],
+                           max_delay=settings["retry_max_delay"],
+                           breaker_threshold=settings["breaker_threshold"],
+                           breaker_cooldown=settings["breaker_cooldown"])
+    configure_resource_governor(max_memory_percent=settings["max_memory_percent"],
+                                max_cpu_percent=settings["max_cpu_percent"])
+    set_debug_output(settings["debug_output"] or DEBUG_OUTPUT_FROM_ENV)
+    if settings["cache_enabled"] and project_path:
+        configure_response_cache(os.path.join(project_path, "cache", "responses"),
+                                 settings["cache_max_mb"] * 1024 * 1024)
+    else:
+        configure_response_cache(None)
+
+
+def safe_image_open(image_path: str, draft_size: Optional[tuple] = None) -> Optional[Image.Image]:
+    wait_for_resources()
     try:
         img = Image.open(image_path)
+        if draft_size:
+            # JPEG pages are decoded directly at a reduced scale, never at full resolution
+            img.draft("RGB", draft_size)
         img.load()
         return img
     except Exception as e:
@@ -55,119 +340,298 @@ def safe_image_open(image_path: str) -> Optional[Image.Image]:
         return None
 
 
-def preprocess_image(image_path: str) -> Optional[bytes]:
-    try:
-        img = safe_image_open(image_path)
-        if not img:
-            return None
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-        max_dimension = 2000
-        if max(img.size) > max_dimension:
-            ratio = max_dimension / max(img.size)
-            new_size = (int(img.size[0] * ratio), int(img.size[1] * ratio))
-            img = img.resize(new_size, Image.LANCZOS)
-        img_bytes = io.BytesIO()
+def list_image_files(folder_path: str) -> List[str]:
+    """
+    Returns the full paths of the images in a folder, in natural page order.
+    """
+    images = sorted([f for f in os.listdir(folder_path) if f.lower().endswith(IMAGE_EXTENSIONS)],
+                    key=_natural_sort_key)
+    return [os.path.join(folder_path, img) for img in images]
+
+
+def _natural_sort_key(name: str) -> list:
+    return [int(c) if c.isdigit() else c for c in re.split(r'([0-9]+)', name)]
+
+
+def preprocess_image(img: Image.Image, image_format: str = DEFAULT_IMAGE_FORMAT,
+                     image_quality: int = DEFAULT_IMAGE_QUALITY) -> bytes:
+    """
+    Shrinks the image to the model's maximum dimension and encodes it once,
+    as PNG (lossless) or as JPEG / WebP with the given quality.
+    """
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    if max(img.size) > MAX_IMAGE_DIMENSION:
+        ratio = MAX_IMAGE_DIMENSION / max(img.size)
+        new_size = (int(img.size[0] * ratio), int(img.size[1] * ratio))
+        img = img.resize(new_size, Image.LANCZOS)
+    image_format = image_format.upper()
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"Format d'image non pris en charge : {image_format}")
+    img_bytes = io.BytesIO()
+    if image_format == "JPEG":
+        img.save(img_bytes, format='JPEG', quality=image_quality, optimize=True)
+    elif image_format == "WEBP":
+        img.save(img_bytes, format='WEBP', quality=image_quality, method=4)
+    else:
         img.save(img_bytes, format='PNG')
-        img.close()
-        return img_bytes.getvalue()
-    except Exception as e:
-        print(f"Preprocessing failed: {str(e)}")
-        return None
-    finally:
-        gc.collect()
+    return img_bytes.getvalue()
+
 
+def merge_images_vertically(image_paths: List[str], max_dimension: Optional[int] = None) -> Image.Image:
+    """
+    Stacks the pages into one image in memory. Page sizes are read from the
+    file headers first, then each page is decoded once and pasted.
 
-def merge_images_vertically(image_paths: List[str], output_path: str) -> str:
-    images = [Image.open(p).convert("RGB") for p in image_paths]
-    widths = [img.width for img in images]
-    heights = [img.height for img in images]
-    total_height = sum(heights)
-    max_width = max(widths)
-    merged_image = Image.new("RGB", (max_width, total_height), color=(255, 255, 255))
+    With max_dimension, the final geometry is computed up front and every page
+    is downscaled as it streams through, so peak memory is one page plus the
+    output canvas instead of the full-resolution stack.
+    """
+    sizes = []
+    for p in image_paths:
+        with Image.open(p) as img:
+            sizes.append(img.size)
+    max_width = max(w for w, _ in sizes)
+    total_height = sum(h for _, h in sizes)
+
+    scale = 1.0
+    if max_dimension and max(max_width, total_height) > max_dimension:
+        scale = max_dimension / max(max_width, total_height)
+    page_sizes = [(max(1, int(w * scale)), max(1, int(h * scale))) for w, h in sizes]
+
+    merged_image = Image.new("RGB", (max(1, int(max_width * scale)), sum(h for _, h in page_sizes)),
+                             color=(255, 255, 255))
     y_offset = 0
-    for img in images:
-        merged_image.paste(img, (0, y_offset))
-        y_offset += img.height
+    for p, page_size in zip(image_paths, page_sizes):
+        img = safe_image_open(p, draft_size=page_size if scale < 1.0 else None)
+        if img is None:
+            merged_image.close()
+            raise ValueError(f"Image illisible : {p}")
+        page = img.convert("RGB")
         img.close()
-    merged_image.save(output_path)
-    return output_path
+        if page.size != page_size:
+            page = page.resize(page_size, Image.LANCZOS)
+        merged_image.paste(page, (0, y_offset))
+        y_offset += page_size[1]
+        page.close()
+    return merged_image
 
 
-def call_vision_model_for_json(image_b64: str, variables_to_extract: List[str]) -> Optional[str]:
+def build_image_payload(image_paths: List[str], merge_mode: str = MERGE_MODE_STREAMING,
+                        image_format: str = DEFAULT_IMAGE_FORMAT, image_quality: int = DEFAULT_IMAGE_QUALITY) -> str:
     """
-    Calls the vision model with a prompt that explicitly asks for a JSON object.
+    Goes from page files to the base64 payload sent to the model, in memory
+    and without temporary files.
     """
-    json_example_keys = {key: "valeur..." for key in variables_to_extract}
+    if not image_paths:
+        raise FileNotFoundError("Aucune image trouvée dans le dossier.")
+    max_dimension = MAX_IMAGE_DIMENSION if merge_mode == MERGE_MODE_STREAMING else None
+    with metrics.stage("merge"):
+        merged_image = merge_images_vertically(image_paths, max_dimension=max_dimension)
+    try:
+        metrics.record_image_size(merged_image.size)
+        with metrics.stage("preprocess"):
+            image_data = preprocess_image(merged_image, image_format=image_format, image_quality=image_quality)
+    finally:
+        merged_image.close()
+        gc.collect()
+    with metrics.stage("base64"):
+        return base64.b64encode(image_data).decode("ascii")
 
-    prompt = f"""Tu es un expert en extraction de données sur des formulaires médicaux.
-    Analyse l'image fournie et extrais les informations pour les variables suivantes : {', '.join(variables_to_extract)}.
-
-    **TÂCHE FINALE :**
-    Ta réponse DOIT être un unique objet JSON valide.
-    Les clés de l'objet JSON DOIVENT correspondre EXACTEMENT aux noms des variables demandées dans la liste.
-    Pour chaque variable de la liste, trouve la valeur correspondante dans le document.
-
-    Règles d’interprétation :
-    - Si une case à cocher est cochée (☑, ✓, X, …), la valeur est "Oui".
-    - Si une case à cocher est vide, la valeur est "Non".
-    - Si une information textuelle n'est pas présente, la valeur doit être "Non renseigné" ou une chaîne vide.
-    - Si l’information est organisée en **tableau croisé avec lignes et colonnes** :
-      • Étape 1 – Numérote toutes les lignes (L1, L2, …) et toutes les colonnes (C1, C2, …).  
-      • Étape 2 – Associe chaque numéro de ligne et de colonne à son texte exact.  
-      • Étape 3 – Pour chaque ligne, ne conserve QUE les colonnes cochées.  
-      • Étape 4 – Dans la sortie finale, pour chaque ligne demandée dans la liste des variables, restitue un tableau contenant uniquement les intitulés exacts des colonnes cochées.  
-      • Si aucune colonne n’est cochée pour une ligne, restitue une liste vide `[]`.  
-      • Ne jamais renvoyer "Oui" ou "Non" dans ce cas : uniquement les intitulés des colonnes cochées.
-
-    ⚠️ Contraintes :
-    - Tu dois toujours restituer la structure JSON strictement valide sans aucun texte supplémentaire.
-    - Le JSON doit être directement exploitable sans parsing manuel.
-
-    Voici un exemple de structure JSON attendue :
-    ```json
-    {json.dumps(json_example_keys, indent=2, ensure_ascii=False)}    
-```
 
-Ne retourne RIEN d'autre que l'objet JSON. Pas de texte explicatif, pas de markdown, juste le JSON.
-"""
+def compare_image_codecs(folder_paths: List[str], codecs: Optional[List[tuple]] = None,
+                         merge_mode: str = MERGE_MODE_STREAMING) -> List[Dict]:
+    """
+    Encodes the merged image of each folder with every (format, quality) pair
+    and reports the average payload size and encode time per codec.
+    """
+    codecs = codecs or CODEC_CANDIDATES
+    stats = {codec: {"bytes": 0, "base64_bytes": 0, "encode_seconds": 0.0, "error": None} for codec in codecs}
+    sampled = 0
+    for folder_path in folder_paths:
+        image_paths = list_image_files(folder_path)
+        if not image_paths:
+            continue
+        merged_image = merge_images_vertically(
+            image_paths, max_dimension=MAX_IMAGE_DIMENSION if merge_mode == MERGE_MODE_STREAMING else None)
+        try:
+            for image_format, image_quality in codecs:
+                entry = stats[(image_format, image_quality)]
+                if entry["error"]:
+                    continue
+                try:
+                    start = perf_counter()
+                    data = preprocess_image(merged_image, image_format=image_format, image_quality=image_quality)
+                    entry["encode_seconds"] += perf_counter() - start
+                    entry["bytes"] += len(data)
+                    entry["base64_bytes"] += 4 * ((len(data) + 2) // 3)
+                except Exception as e:
+                    entry["error"] = str(e)
+        finally:
+            merged_image.close()
+            gc.collect()
+        sampled += 1
+
+    if not sampled:
+        raise FileNotFoundError("Aucune image trouvée dans les dossiers échantillons.")
+    report = []
+    for (image_format, image_quality), entry in stats.items():
+        report.append({
+            "format": image_format,
+            "quality": image_quality if image_format != "PNG" else None,
+            "avg_bytes": entry["bytes"] // sampled,
+            "avg_base64_bytes": entry["base64_bytes"] // sampled,
+            "avg_encode_ms": round(entry["encode_seconds"] * 1000 / sampled, 1),
+            "error": entry["error"],
+        })
+    return report
 
+
+def _has_json_object(text: str) -> bool:
+    # Both prompts ask for a JSON object: a reply without one is not worth caching
+    return recover_json_object(text)[0] is not None
+
+
+def _call_vision_model(prompt: str, image_b64: str, label: str) -> str:
+    """
+    Sends a prompt and an image to the shared vision client, through the
+    shared retry policy and circuit breaker.
+    """
     payload = {
         "prompt": prompt,
         "image_base64": image_b64,
         "max_tokens": 4096,
         "temperature": 0.0,
     }
-    for attempt in range(MAX_RETRIES):
-        try:
-            response = requests.post(RUNPOD_ENDPOINT, json=payload, timeout=300)
-            response.raise_for_status()
-            data = response.json()
-            text = data.get("text") or data.get("output", "")
-            print(f"\n📤 Réponse brute (JSON attendu) du modèle de vision RunPod :\n{text}\n")
-            return text.strip()
-        except Exception as e:
-            print(f"⚠️ Tentative d'appel au modèle de vision {attempt + 1} échouée : {str(e)}")
-            if attempt == MAX_RETRIES - 1:
-                return f"ERROR: {str(e)}"
-            sleep(RETRY_DELAY)
-    return "ERROR: L'appel au modèle de vision a échoué après plusieurs tentatives."
+    client = get_vision_client()
+
+    def on_retry(attempt, error, delay):
+        metrics.count("retries")
+        print(f"⚠️ Tentative d'appel au modèle de vision {attempt + 1} échouée : {str(error)} "
+              f"(nouvel essai dans {delay:.1f} s)")
+
+    try:
+        with metrics.stage("http"):
+            text = call_with_retries(lambda: client.generate(payload, is_valid=_has_json_object),
+                                     client.retry_policy, client.circuit_breaker, on_retry=on_retry)
+    except VisionRequestError as e:
+        metrics.count("request_failures")
+        print(f"⚠️ Appel au modèle de vision abandonné : {str(e)}")
+        return f"ERROR: {str(e)}"
+    if DEBUG_OUTPUT:
+        print(f"\n📤 Réponse brute ({label}) du modèle de vision RunPod :\n{text}\n")
+    return text.strip()
+
+
+# Fixed rules sent first in every extraction request, so that the server can
+# reuse its KV cache for this prefix; the per-project variable block comes last.
+EXTRACTION_PROMPT_PREAMBLE = """Tu es un expert en extraction de données sur des formulaires médicaux.
+Analyse l'image fournie et extrais les informations pour les variables listées à la fin de ce message.
+
+**TÂCHE FINALE :**
+Ta réponse DOIT être un unique objet JSON valide.
+Les clés de l'objet JSON DOIVENT correspondre EXACTEMENT aux noms des variables demandées dans la liste.
+Pour chaque variable de la liste, trouve la valeur correspondante dans le document.
+
+Règles d’interprétation :
+- Si une case à cocher est cochée (☑, ✓, X, …), la valeur est "Oui".
+- Si une case à cocher est vide, la valeur est "Non".
+- Si une information textuelle n'est pas présente, la valeur doit être "Non renseigné" ou une chaîne vide.
+- Si l’information est organisée en **tableau croisé avec lignes et colonnes** :
+  • Étape 1 – Numérote toutes les lignes (L1, L2, …) et toutes les colonnes (C1, C2, …).
+  • Étape 2 – Associe chaque numéro de ligne et de colonne à son texte exact.
+  • Étape 3 – Pour chaque ligne, ne conserve QUE les colonnes cochées.
+  • Étape 4 – Dans la sortie finale, pour chaque ligne demandée dans la liste des variables, restitue un tableau contenant uniquement les intitulés exacts des colonnes cochées.
+  • Si aucune colonne n’est cochée pour une ligne, restitue une liste vide `[]`.
+  • Ne jamais renvoyer "Oui" ou "Non" dans ce cas : uniquement les intitulés des colonnes cochées.
+
+⚠️ Contraintes :
+- Tu dois toujours restituer la structure JSON strictement valide sans aucun texte supplémentaire.
+- Le JSON doit être directement exploitable sans parsing manuel.
+- Ne retourne RIEN d'autre que l'objet JSON. Pas de texte explicatif, pas de markdown, juste le JSON.
+
+"""
+PROMPT_CACHE_SIZE = 256  # distinct variable blocks kept, e.g. one per variable chunk
+CHARS_PER_TOKEN = 4  # rough estimate, the server's tokenizer is not available here
+
+
+@lru_cache(maxsize=PROMPT_CACHE_SIZE)
+def build_extraction_prompt(variables_to_extract: tuple) -> str:
+    """
+    Invariant preamble followed by the variable block. Built once per
+    distinct key list, then reused for every patient of the run.
+    """
+    json_example_keys = {key: "valeur..." for key in variables_to_extract}
+    return (EXTRACTION_PROMPT_PREAMBLE
+            + f"Variables à extraire : {', '.join(variables_to_extract)}.\n\n"
+            + "Voici un exemple de structure JSON attendue :\n"
+            + f"```json\n{json.dumps(json_example_keys, indent=2, ensure_ascii=False)}\n```\n")
+
+
+def build_extraction_keys(variables: List[Dict]) -> List[str]:
+    """
+    Keys asked to the model: one per variable, one per option of a group.
+    """
+    keys = []
+    for var in variables:
+        if var.get('type') == 'group':
+            for option in var.get('options', []):
+                keys.append(f"{var['name']}: {option}")
+        else:
+            keys.append(var['name'])
+    return keys
+
+
+def chunk_extraction_keys(keys: List[str], variable_chunk_size: int = 0) -> List[List[str]]:
+    if variable_chunk_size and variable_chunk_size > 0:
+        return [keys[i:i + variable_chunk_size] for i in range(0, len(keys), variable_chunk_size)]
+    return [keys]
+
+
+def prompt_size_report(variables: List[Dict], variable_chunk_size: int = 0) -> Dict:
+    """
+    Characters and estimated tokens of the extraction prompts of a project,
+    and how much of each prompt is the prefix shared by every request.
+    """
+    chunks = chunk_extraction_keys(build_extraction_keys(variables), variable_chunk_size)
+    prompt_chars = [len(build_extraction_prompt(tuple(keys))) for keys in chunks]
+    prefix_chars = len(EXTRACTION_PROMPT_PREAMBLE)
+    total_chars = sum(prompt_chars)
+    return {
+        "requests_per_image": len(chunks),
+        "prefix_chars": prefix_chars,
+        "prefix_tokens_estimate": prefix_chars // CHARS_PER_TOKEN,
+        "prompt_chars_max": max(prompt_chars),
+        "prompt_tokens_estimate_max": max(prompt_chars) // CHARS_PER_TOKEN,
+        "shared_prefix_ratio": round(prefix_chars * len(chunks) / total_chars, 3) if total_chars else 0.0,
+    }
+
+
+def format_prompt_report(report: Dict) -> str:
+    return (f"📝 Prompt : {report['prompt_chars_max']} caractères (≈ {report['prompt_tokens_estimate_max']} tokens), "
+            f"dont {report['prefix_chars']} (≈ {report['prefix_tokens_estimate']} tokens) de préambule commun "
+            f"({report['shared_prefix_ratio']:.0%} du texte), {report['requests_per_image']} requête(s) par image")
+
+
+def call_vision_model_for_json(image_b64: str, variables_to_extract: List[str]) -> Optional[str]:
+    """
+    Calls the vision model with a prompt that explicitly asks for a JSON object.
+    """
+    prompt = build_extraction_prompt(tuple(variables_to_extract))
+    return _call_vision_model(prompt, image_b64, "JSON attendu")
 
 
 def parse_json_response(json_string: str) -> Optional[dict]:
     """
-    Parses the JSON string returned by the model.
+    Parses the JSON object returned by the model, repairing common defects
+    (see json_recovery.recover_json_object).
     """
-    match = re.search(r'\{.*\}', json_string, re.DOTALL)
-    if not match:
-        print("Erreur de parsing : Aucun objet JSON trouvé dans la réponse du modèle.")
-        return None
-    clean_json_str = match.group(0)
-    try:
-        return json.loads(clean_json_str)
-    except json.JSONDecodeError:
-        print("Erreur de parsing : La réponse du modèle n'est pas un JSON valide.")
-        return None
+    data, repairs = recover_json_object(json_string)
+    if data is None:
+        print("Erreur de parsing : Aucun objet JSON exploitable dans la réponse du modèle.")
+    elif repairs:
+        print(f"⚠️ Réponse JSON réparée ({', '.join(repairs)}).")
+    return data
 
 
 def consolidate_group_results(model_output: dict, original_variables: List[Dict], warnings: List[str]) -> dict:
@@ -186,7 +650,7 @@ def consolidate_group_results(model_output: dict, original_variables: List[Dict]
             checked_options = []
             for option in var_spec.get('options', []):
                 sub_var_name = f"{var_name}: {option}".lower()
-                if model_output_lower.get(sub_var_name, "Non").lower() == 'oui':
+                if str(model_output_lower.get(sub_var_name, "Non")).lower() == 'oui':
                     checked_options.append(option)
 
             if len(checked_options) == 1:
@@ -239,26 +703,7 @@ La valeur de "variables" doit être une liste de chaînes de caractères, où ch
 Ne retourne RIEN d'autre que l'objet JSON. Pas de texte explicatif, pas de markdown, juste le JSON.
 """
 
-    payload = {
-        "prompt": prompt,
-        "image_base64": image_b64,
-        "max_tokens": 4096,
-        "temperature": 0.0,
-    }
-    for attempt in range(MAX_RETRIES):
-        try:
-            response = requests.post(RUNPOD_ENDPOINT, json=payload, timeout=300)
-            response.raise_for_status()
-            data = response.json()
-            text = data.get("text") or data.get("output", "")
-            print(f"\n📤 Réponse brute (détection de variables) du modèle de vision RunPod :\n{text}\n")
-            return text.strip()
-        except Exception as e:
-            print(f"⚠️ Tentative d'appel au modèle de vision {attempt + 1} échouée : {str(e)}")
-            if attempt == MAX_RETRIES - 1:
-                return f"ERROR: {str(e)}"
-            sleep(RETRY_DELAY)
-    return "ERROR: L'appel au modèle de vision a échoué après plusieurs tentatives."
+    return _call_vision_model(prompt, image_b64, "détection de variables")
 
 
 def detect_variables_from_image_folder(folder_path: str) -> Dict:
@@ -271,25 +716,10 @@ def detect_variables_from_image_folder(folder_path: str) -> Dict:
     print(f"\n📂 Lancement de la détection de variables pour le dossier : {folder_path}")
 
     try:
-        images = sorted([f for f in os.listdir(folder_path) if f.lower().endswith(('.png', '.jpg', '.jpeg'))],
-                        key=lambda x: [int(c) if c.isdigit() else c for c in re.split(r'([0-9]+)', x)])
-        if not images:
-            raise FileNotFoundError("Aucune image trouvée dans le dossier.")
-
-        full_image_paths = [os.path.join(folder_path, img) for img in images]
+        full_image_paths = list_image_files(folder_path)
 
         print("⏳ Fusion des images pour la détection...")
-        merged_path = os.path.join(tempfile.gettempdir(), "merged_detection.png")
-        merge_images_vertically(full_image_paths, merged_path)
-
-        if not validate_image_file(merged_path):
-            raise ValueError(f"L'image fusionnée est invalide: {merged_path}")
-
-        image_data = preprocess_image(merged_path)
-        if not image_data:
-            raise ValueError("Échec du prétraitement de l'image.")
-
-        encoded_image = base64.b64encode(image_data).decode("utf-8")
+        encoded_image = build_image_payload(full_image_paths)
 
         print("🤖 Appel du modèle de vision pour la détection de variables...")
         raw_response = call_vision_model_for_variable_detection(encoded_image)
@@ -314,66 +744,239 @@ def detect_variables_from_image_folder(folder_path: str) -> Dict:
     return results_wrapper
 
 
-def extract_data_from_image_folder(folder_path: str, variables: List[Dict]) -> Dict:
-    results_wrapper = {
-        "pages": [], "errors": [], "variables": {}, "warnings": []
-    }
-    print(f"\n📂 Traitement du dossier : {folder_path}")
-    print(f"🔎 Variables définies par l'utilisateur : {variables}\n")
+def _value_rank(value) -> int:
+    """
+    Ranks how informative a value is, so that partial results can be merged:
+    empty / "Non renseigné" < "Non" or [] < any other answer.
+    """
+    if isinstance(value, list):
+        return 2 if value else 1
+    text = str(value).strip().lower()
+    if text in ("", "non renseigné"):
+        return 0
+    if text == "non":
+        return 1
+    return 2
 
-    try:
-        images = sorted([f for f in os.listdir(folder_path) if f.lower().endswith(('.png', '.jpg', '.jpeg'))],
-                        key=lambda x: [int(c) if c.isdigit() else c for c in re.split(r'([0-9]+)', x)])
-        if not images:
-            raise FileNotFoundError("Aucune image trouvée dans le dossier.")
 
-        full_image_paths = [os.path.join(folder_path, img) for img in images]
+def merge_partial_results(partial_results: List[dict]) -> dict:
+    """
+    Merges the JSON objects returned for separate requests of one patient,
+    keeping for each key the most informative value (the first one on ties).
+    """
+    merged = {}
+    for part in partial_results:
+        for key, value in part.items():
+            if key not in merged or _value_rank(value) > _value_rank(merged[key]):
+                merged[key] = value
+    return merged
 
-        print("⏳ Fusion des images...")
-        merged_path = os.path.join(tempfile.gettempdir(), "merged_patient.png")
-        merge_images_vertically(full_image_paths, merged_path)
 
-        if not validate_image_file(merged_path):
-            raise ValueError(f"L'image fusionnée est invalide: {merged_path}")
+def _run_concurrently(fn, items: list, max_parallel: int) -> list:
+    """
+    Calls fn on every item, at most max_parallel at a time, and returns the
+    results in item order.
+    """
+    if len(items) <= 1 or max_parallel <= 1:
+        return [fn(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(len(items), max_parallel)) as executor:
+        return list(executor.map(bind_cancel_event(metrics.bind_metrics(fn)), items))
 
-        image_data = preprocess_image(merged_path)
-        if not image_data:
-            raise ValueError("Échec du prétraitement de l'image.")
 
-        encoded_image = base64.b64encode(image_data).decode("utf-8")
+def find_invalid_keys(data: Dict, keys: List[str], variables: List[Dict]) -> List[str]:
+    """
+    Requested keys whose value cannot be used: a checkbox (group option) that
+    is not answered "Oui" / "Non", or a null or nested-object value.
+    """
+    group_keys = {f"{var['name']}: {option}".lower() for var in variables if var.get('type') == 'group'
+                  for option in var.get('options', [])}
+    values = {key.lower(): value for key, value in data.items()}
+    invalid = []
+    for key in keys:
+        if key.lower() not in values:
+            continue
+        value = values[key.lower()]
+        if key.lower() in group_keys:
+            valid = isinstance(value, str) and value.strip().lower() in ("oui", "non", "non renseigné")
+        else:
+            valid = value is not None and not isinstance(value, dict)
+        if not valid:
+            invalid.append(key)
+    return invalid
 
-        # Build the list of variables to query the model
-        variables_to_extract = []
-        for var in variables:
-            if var.get('type') == 'group':
-                for option in var.get('options', []):
-                    variables_to_extract.append(f"{var['name']}: {option}")
-            else:
-                variables_to_extract.append(var['name'])
 
-        print(f"🤖 Appel du modèle de vision avec les sous-questions pour les groupes...")
-        raw_response = call_vision_model_for_json(encoded_image, variables_to_extract)
+def _requery_missing_keys(jobs: list, job_results: list, variables: List[Dict], process_job, max_parallel: int) -> list:
+    """
+    Sends one follow-up request per answer with missing or invalid keys, for
+    those keys only, and merges the follow-up into the first answer. A key
+    is asked again only if no page answered it validly in its variable chunk,
+    so a page that legitimately lacks a key does not trigger a follow-up.
+    Answers with no usable JSON at all are not repeated: the same request
+    would be sent again. Neither are HTTP failures: the retry policy already did.
+    """
+    chunks = {}
+    for index, (_, keys) in enumerate(jobs):
+        chunks.setdefault(tuple(keys), []).append(index)
+
+    followups = []
+    for keys, indexes in chunks.items():
+        answers = [job_results[index][1]["data"] for index in indexes if job_results[index][1] is not None]
+        if not answers:
+            continue
+        chunk_data = merge_partial_results(answers)
+        answered = {key.lower() for key in chunk_data}
+        unresolved = {key.lower() for key in keys if key.lower() not in answered}
+        unresolved.update(key.lower() for key in find_invalid_keys(chunk_data, list(keys), variables))
+        if not unresolved:
+            continue
+        for index in indexes:
+            report = job_results[index][1]
+            if report is None:
+                continue
+            job_retry = report["missing_keys"] + find_invalid_keys(report["data"], list(keys), variables)
+            retry_keys = [key for key in job_retry if key.lower() in unresolved]
+            if retry_keys:
+                followups.append((index, (jobs[index][0], retry_keys)))
+    if not followups:
+        return job_results
+
+    print(f"🔁 Relance du modèle pour {sum(len(keys) for _, (_, keys) in followups)} "
+          f"variable(s) manquante(s) ou invalide(s)...")
+    metrics.count("requery_requests", len(followups))
+    followup_results = _run_concurrently(process_job, [job for _, job in followups], max_parallel)
+
+    job_results = list(job_results)
+    for (index, (_, retry_keys)), (followup_raw, followup_report, _) in zip(followups, followup_results):
+        raw_response, report, error = job_results[index]
+        if followup_report is None or not followup_report["data"]:
+            continue
+        retry_lower = {key.lower() for key in retry_keys}
+        merged = {key: value for key, value in report["data"].items() if key.lower() not in retry_lower}
+        merged.update({key: value for key, value in followup_report["data"].items() if key.lower() in retry_lower})
+        answered = {key.lower() for key in merged}
+        job_keys = jobs[index][1]
+        job_results[index] = (raw_response + "\n--- relance ---\n" + followup_raw, {
+            "data": merged,
+            "repairs": report["repairs"] + followup_report["repairs"],
+            "recovered_keys": report["recovered_keys"],
+            "missing_keys": [key for key in job_keys if key.lower() not in answered],
+            "requeried_keys": retry_keys,
+        }, None)
+    return job_results
+
+
+def extract_data_from_image_folder(folder_path: str, variables: List[Dict],
+                                   merge_mode: str = MERGE_MODE_STREAMING,
+                                   extraction_mode: str = EXTRACTION_MODE_MERGED,
+                                   pages_per_request: int = 1,
+                                   max_parallel_requests: int = 4,
+                                   variable_chunk_size: int = 0,
+                                   image_format: str = DEFAULT_IMAGE_FORMAT,
+                                   image_quality: int = DEFAULT_IMAGE_QUALITY,
+                                   requery_missing: bool = True) -> Dict:
+    """
+    Extracts the variables of one patient. In "merged" mode all pages are sent
+    as one stacked image; in "per_page" mode each group of pages_per_request
+    pages is sent as its own request, concurrently, and the answers merged.
+    With variable_chunk_size, the requested keys are also split into chunks
+    sent as concurrent requests against the same encoded image.
+    With requery_missing, keys missing from an answer or with an invalid value
+    are asked again, once, in a follow-up request on the same encoded image.
+    """
+    results_wrapper = {
+        "pages": [], "errors": [], "variables": {}, "warnings": []
+    }
+    print(f"\n📂 Traitement du dossier : {folder_path}")
+    if DEBUG_OUTPUT:
+        print(f"🔎 Variables définies par l'utilisateur : {variables}\n")
 
-        if not raw_response or raw_response.startswith("ERROR"):
-            raise ValueError(f"Erreur du modèle de vision : {raw_response}")
+    try:
+        full_image_paths = list_image_files(folder_path)
+        if not full_image_paths:
+            raise FileNotFoundError("Aucune image trouvée dans le dossier.")
 
-        print("✅ Réponse reçue, parsing du JSON...")
-        parsed_data = parse_json_response(raw_response)
-        if not parsed_data:
-            raise ValueError("Impossible de parser la réponse JSON du modèle.")
+        if extraction_mode == EXTRACTION_MODE_PER_PAGE:
+            step = max(1, int(pages_per_request))
+            page_groups = [full_image_paths[i:i + step] for i in range(0, len(full_image_paths), step)]
+        else:
+            page_groups = [full_image_paths]
+
+        # Build the list of variables to query the model
+        key_chunks = chunk_extraction_keys(build_extraction_keys(variables), variable_chunk_size)
+
+        print(f"⏳ Préparation de {len(page_groups)} image(s)...")
+        encoded_images = _run_concurrently(
+            lambda paths: build_image_payload(paths, merge_mode=merge_mode,
+                                              image_format=image_format, image_quality=image_quality),
+            page_groups, max_parallel_requests)
+
+        # One request per (page group, variable chunk), all sharing the encoded images
+        jobs = [(group_index, keys) for group_index in range(len(page_groups)) for keys in key_chunks]
+
+        def process_job(job):
+            group_index, keys = job
+            print(f"🤖 Appel du modèle de vision pour {len(keys)} variable(s)...")
+            raw_response = call_vision_model_for_json(encoded_images[group_index], keys)
+            if not raw_response or raw_response.startswith("ERROR"):
+                return raw_response, None, f"Erreur du modèle de vision : {raw_response}"
+            with metrics.stage("parse"):
+                report = recover_json_response(raw_response, keys)
+            if not report["data"]:
+                metrics.count("parse_failures")
+                return raw_response, None, "Impossible de parser la réponse JSON du modèle."
+            if report["repairs"]:
+                metrics.count("parse_recoveries")
+            return raw_response, report, None
+
+        job_results = _run_concurrently(process_job, jobs, max_parallel_requests)
+
+        if requery_missing:
+            job_results = _requery_missing_keys(jobs, job_results, variables, process_job, max_parallel_requests)
+
+        partial_results = []
+        for (group_index, keys), (raw_response, report, error) in zip(jobs, job_results):
+            image_paths = page_groups[group_index]
+            pages = ", ".join(os.path.basename(p) for p in image_paths)
+            if error:
+                if len(jobs) == 1:
+                    raise ValueError(error)
+                results_wrapper["errors"].append(f"{pages} ({len(keys)} variable(s)) : {error}")
+                continue
+            parsed = report["data"]
+            if report.get("requeried_keys"):
+                results_wrapper["warnings"].append(
+                    f"Relance pour {pages} : {', '.join(report['requeried_keys'])}")
+            if report["repairs"] or report["missing_keys"]:
+                results_wrapper["warnings"].append(
+                    f"Réponse JSON incomplète ou réparée pour {pages} ({', '.join(report['repairs']) or 'clés absentes'}) : "
+                    f"{len(parsed)} clé(s) récupérée(s), manquantes : {', '.join(report['missing_keys']) or 'aucune'}")
+            partial_results.append(parsed)
+            if len(jobs) > 1:
+                results_wrapper["pages"].append({
+                    "filename": pages, "text": raw_response, "path": image_paths[0]
+                })
+        if not partial_results:
+            raise ValueError("Aucune requête n'a pu être extraite.")
+
+        print("✅ Réponses reçues, fusion des résultats...")
+        parsed_data = merge_partial_results(partial_results)
+        answered = {key.lower() for key in parsed_data}
+        results_wrapper["missing_keys"] = [key for keys in key_chunks for key in keys if key.lower() not in answered]
 
         print("🔄 Consolidation des résultats des groupes...")
-        final_data = consolidate_group_results(parsed_data, variables, results_wrapper["warnings"])
+        with metrics.stage("consolidate"):
+            final_data = consolidate_group_results(parsed_data, variables, results_wrapper["warnings"])
 
-        print("📊 Données finales structurées :")
-        for k, v in final_data.items():
-            print(f"  {k}: {v}")
+        if DEBUG_OUTPUT:
+            print("📊 Données finales structurées :")
+            for k, v in final_data.items():
+                print(f"  {k}: {v}")
 
         results_wrapper["variables"] = final_data
-        results_wrapper["pages"].append({
-            "filename": "MERGED_IMAGE", "text": raw_response,
-            "structured": json.dumps(final_data, ensure_ascii=False), "path": "MERGED_VIRTUAL"
-        })
+        if len(jobs) == 1:
+            results_wrapper["pages"].append({
+                "filename": "MERGED_IMAGE", "text": job_results[0][0], "path": "MERGED_VIRTUAL"
+            })
 
     except Exception as e:
         results_wrapper["errors"].append(str(e))
@@ -383,36 +986,101 @@ def extract_data_from_image_folder(folder_path: str, variables: List[Dict]) -> D
     return results_wrapper
 
 
-def prepare_patient_folders(source_dir: str, output_dir: str, pages_per_questionnaire: int) -> List[Dict]:
-    # This function remains unchanged
+def _reflink(src_path: str, dest_path: str):
+    """
+    Clones the file with copy-on-write (btrfs, XFS, ...): no data is duplicated.
+    """
+    import fcntl
+    with open(src_path, 'rb') as src, open(dest_path, 'wb') as dest:
+        fcntl.ioctl(dest.fileno(), FICLONE, src.fileno())
+    shutil.copystat(src_path, dest_path)
+
+
+def import_scan_file(src_path: str, dest_path: str, import_mode: str = IMPORT_MODE_AUTO) -> str:
+    """
+    Places one scan in a patient folder and returns the method used. In "auto"
+    mode a reflink, then a hardlink, is tried before falling back to a copy.
+    """
+    wait_for_resources()
+    if os.path.lexists(dest_path):
+        os.remove(dest_path)
+    if import_mode == IMPORT_MODE_AUTO:
+        if sys.platform.startswith("linux"):
+            try:
+                _reflink(src_path, dest_path)
+                return "reflink"
+            except OSError:
+                if os.path.exists(dest_path):
+                    os.remove(dest_path)
+        try:
+            os.link(src_path, dest_path)
+            return "hardlink"
+        except OSError:
+            pass
+    shutil.copy2(src_path, dest_path)
+    return "copy"
+
+
+def prepare_patient_folders(source_dir: str, output_dir: str, pages_per_questionnaire: int,
+                            import_mode: str = IMPORT_MODE_AUTO, max_workers: int = DEFAULT_IMPORT_WORKERS,
+                            progress_callback=None) -> List[Dict]:
+    """
+    Splits the scans into one folder per patient. Files are linked when the
+    filesystem allows it and copied in parallel otherwise; progress_callback
+    is called with (files done, total files) after each file, and also
+    periodically while no file completes (e.g. during a resource pause), so
+    that a GUI calling this on its own thread keeps processing its events.
+    """
     questionnaires = []
     try:
-        images = sorted([f for f in os.listdir(source_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg'))],
-                        key=lambda x: [int(c) if c.isdigit() else c for c in re.split('([0-9]+)', x)])
+        images = sorted([f for f in os.listdir(source_dir) if f.lower().endswith(IMAGE_EXTENSIONS)],
+                        key=_natural_sort_key)
         os.makedirs(output_dir, exist_ok=True)
+
+        tasks = []
         for i in range(0, len(images), pages_per_questionnaire):
-            check_system_resources()
             batch = images[i:i + pages_per_questionnaire]
             patient_num = (i // pages_per_questionnaire) + 1
             patient_dir = os.path.join(output_dir, f"Patient_{patient_num:03d}")
             os.makedirs(patient_dir, exist_ok=True)
-            source_images = []
+            pages = []
             for idx, img_file in enumerate(batch):
-                src_path = os.path.join(source_dir, img_file)
                 ext = os.path.splitext(img_file)[1]
-                dest_path = os.path.join(patient_dir, f"page_{idx + 1:02d}{ext}")
-                try:
-                    shutil.copy2(src_path, dest_path)
-                    source_images.append(dest_path)
-                except Exception as e:
-                    print(f"Error copying {src_path}: {str(e)}")
+                pages.append((os.path.join(source_dir, img_file),
+                              os.path.join(patient_dir, f"page_{idx + 1:02d}{ext}")))
+            tasks.append((patient_num, patient_dir, pages))
+
+        total_files = len(images)
+        imported = set()
+        methods = {}
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = {executor.submit(import_scan_file, src, dest, import_mode): (src, dest)
+                       for _, _, pages in tasks for src, dest in pages}
+            remaining = set(futures)
+            done = 0
+            while remaining:
+                completed, remaining = wait(remaining, timeout=IMPORT_POLL_INTERVAL, return_when=FIRST_COMPLETED)
+                if not completed and progress_callback:
+                    progress_callback(done, total_files)
+                for future in completed:
+                    done += 1
+                    src_path, dest_path = futures[future]
+                    try:
+                        method = future.result()
+                        methods[method] = methods.get(method, 0) + 1
+                        imported.add(dest_path)
+                    except Exception as e:
+                        print(f"Error copying {src_path}: {str(e)}")
+                    if progress_callback:
+                        progress_callback(done, total_files)
+        print(f"📥 Importation : {methods}")
+
+        for patient_num, patient_dir, pages in tasks:
             questionnaires.append({
                 'patient_dir': patient_dir,
-                'source_images': source_images,
+                'source_images': [dest for _, dest in pages if dest in imported],
                 'questionnaire_num': patient_num
             })
-            if len(questionnaires) % 5 == 0:
-                gc.collect()
     except Exception as e:
         print(f"Error preparing folders: {str(e)}")
     finally:
@@ -0,0 +1,152 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from PyQt5.QtGui import QImage, QImageReader
+from PyQt5.QtCore import QSize, Qt
+
+# Constants
+DEFAULT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_ZOOM = 100  # percent of the scan's full resolution
+MAX_ENTRY_FRACTION = 0.125  # larger pages are decoded for display but never cached or prefetched
+PREFETCH_WORKERS = 2
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def _natural_sort_key(name: str) -> list:
+    return [int(c) if c.isdigit() else c for c in re.split('([0-9]+)', name)]
+
+
+def decode_page(path: str, zoom: int = DEFAULT_ZOOM) -> Optional[QImage]:
+    """
+    Decodes a page at the size it is displayed, zoom percent of the scan's
+    resolution: downscaled while reading below 100%, enlarged from the
+    full-resolution decode above it. Returns None if the file is unreadable.
+    QImage, unlike QPixmap, may be created outside the GUI thread.
+    """
+    reader = QImageReader(path)
+    reader.setAutoTransform(True)
+    size = reader.size()
+    if size.isValid() and zoom < 100:
+        reader.setScaledSize(QSize(max(1, size.width() * zoom // 100), max(1, size.height() * zoom // 100)))
+    image = reader.read()
+    if image.isNull():
+        return None
+    if zoom > 100:
+        image = image.scaled(max(1, image.width() * zoom // 100), max(1, image.height() * zoom // 100),
+                             Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    return image
+
+
+def estimate_page_bytes(path: str, zoom: int = DEFAULT_ZOOM) -> Optional[int]:
+    """
+    Memory taken by the page decoded at the given zoom, from the image header
+    only (32 bits per pixel). None if the size cannot be read.
+    """
+    size = QImageReader(path).size()
+    if not size.isValid():
+        return None
+    return max(1, size.width() * zoom // 100) * max(1, size.height() * zoom // 100) * 4
+
+
+class PageCache:
+    """
+    LRU cache of pages decoded at their display size, one entry per (page,
+    zoom), bounded in bytes, with background prefetching of the pages the
+    reviewer is likely to open next: the GUI thread never rescales a page.
+    A page larger than MAX_ENTRY_FRACTION of the budget (a high zoom) is
+    neither kept nor prefetched. Folder listings are cached too and
+    refreshed when the folder changes.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = int(max_bytes * MAX_ENTRY_FRACTION)
+        self._pages = OrderedDict()  # (path, zoom) -> (image, size in bytes)
+        self._total_bytes = 0
+        self._pending = {}  # (path, zoom) -> Future of a prefetch in progress
+        self._listings = {}  # folder -> (mtime, file names)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="page-prefetch")
+
+    def list_pages(self, folder: str) -> List[str]:
+        """
+        Page file names of a patient folder, in natural order.
+        """
+        try:
+            mtime = os.stat(folder).st_mtime
+        except OSError:
+            return []
+        with self._lock:
+            cached = self._listings.get(folder)
+            if cached and cached[0] == mtime:
+                return cached[1]
+        names = sorted((f for f in os.listdir(folder) if f.lower().endswith(IMAGE_EXTENSIONS)),
+                       key=_natural_sort_key)
+        with self._lock:
+            self._listings[folder] = (mtime, names)
+        return names
+
+    def get(self, path: str, zoom: int = DEFAULT_ZOOM) -> Optional[QImage]:
+        """
+        Returns the page at the given zoom, from the cache, from a prefetch in
+        progress, or decoded now.
+        """
+        key = (path, zoom)
+        with self._lock:
+            if key in self._pages:
+                self._pages.move_to_end(key)
+                return self._pages[key][0]
+            pending = self._pending.get(key)
+        if pending is not None:
+            return pending.result()
+        return self._load(path, zoom)
+
+    def prefetch(self, paths: List[str], zoom: int = DEFAULT_ZOOM):
+        """
+        Decodes the given pages on a background thread if they are not cached
+        and small enough to be kept.
+        """
+        for path in paths:
+            if not path:
+                continue
+            estimate = estimate_page_bytes(path, zoom)
+            if estimate is None or estimate > self.max_entry_bytes:
+                continue
+            key = (path, zoom)
+            with self._lock:
+                if key not in self._pages and key not in self._pending:
+                    self._pending[key] = self._executor.submit(self._load, path, zoom)
+
+    def _load(self, path: str, zoom: int) -> Optional[QImage]:
+        key = (path, zoom)
+        try:
+            image = decode_page(path, zoom)
+        except Exception as e:
+            print(f"Error decoding page {path}: {str(e)}")
+            image = None
+        with self._lock:
+            self._pending.pop(key, None)
+            size = image.sizeInBytes() if image is not None else 0
+            if image is not None and key not in self._pages and size <= self.max_entry_bytes:
+                self._pages[key] = (image, size)
+                self._total_bytes += size
+                while self._total_bytes > self.max_bytes:
+                    _, (_, evicted_size) = self._pages.popitem(last=False)
+                    self._total_bytes -= evicted_size
+        return image
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+            self._listings.clear()
+            self._total_bytes = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"pages": len(self._pages), "bytes": self._total_bytes, "pending": len(self._pending)}
+
+    def close(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,296 @@
+import os
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from response_archive import ResponseArchive, split_raw_responses
+
+# Constants
+DATABASE_NAME = "project.db"
+LEGACY_PROJECT_FILE = "project.json"
+SCHEMA_VERSION = 2  # 2: raw model responses moved to the response archive
+MIGRATION_RUN = "migration"
+# Project keys stored as JSON values in the meta table
+META_KEYS = ("scans_source_dir", "pages_per_questionnaire", "extraction_settings")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS variables (
+    position INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    definition TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS questionnaires (
+    patient_id TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    definition TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS extractions (
+    patient_id TEXT PRIMARY KEY,
+    error TEXT,
+    fingerprint TEXT,
+    result TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS extracted_values (
+    patient_id TEXT NOT NULL REFERENCES extractions(patient_id) ON DELETE CASCADE,
+    variable TEXT NOT NULL,
+    value TEXT,
+    PRIMARY KEY (patient_id, variable)
+);
+CREATE TABLE IF NOT EXISTS edits (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    patient_id TEXT NOT NULL,
+    variable TEXT NOT NULL,
+    old_value TEXT,
+    new_value TEXT,
+    edited_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_questionnaires_position ON questionnaires(position);
+CREATE INDEX IF NOT EXISTS idx_edits_patient ON edits(patient_id, variable);
+"""
+
+
+def new_project_data() -> Dict:
+    """
+    Returns the content of an empty project.
+    """
+    return {
+        'scans_source_dir': None,
+        'extracted_data': {},
+        'variables': [],
+        'pages_per_questionnaire': 1,
+        'compiled_questionnaires': [],
+        'extraction_settings': {}
+    }
+
+
+def _patient_id(questionnaire: Dict) -> str:
+    return os.path.basename(questionnaire['patient_dir'])
+
+
+class ProjectStore:
+    """
+    Project state kept in an SQLite database next to the patient folders.
+    load() returns the same dictionary the views have always worked on;
+    extraction results and cell edits are written one row at a time, in
+    their own transaction, instead of rewriting the whole project. Raw model
+    responses go to a ResponseArchive and are only read on demand.
+    """
+
+    def __init__(self, project_path: str):
+        self.project_path = project_path
+        self.path = os.path.join(project_path, DATABASE_NAME)
+        self._lock = threading.Lock()
+        self.responses = ResponseArchive(project_path)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        with self._conn:
+            self._conn.executescript(SCHEMA)
+            self._conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('schema_version', ?)",
+                               (json.dumps(SCHEMA_VERSION),))
+        version = json.loads(self._conn.execute("SELECT value FROM meta WHERE key = 'schema_version'").fetchone()[0])
+        if version < 2:
+            self._archive_stored_responses()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT COUNT(*) FROM meta WHERE key != 'schema_version'").fetchone()
+        return row[0] == 0
+
+    def load(self) -> Dict:
+        """
+        Reads the whole project into the dictionary used by the views.
+        """
+        project_data = new_project_data()
+        with self._lock:
+            for key, value in self._conn.execute("SELECT key, value FROM meta"):
+                if key in META_KEYS:
+                    project_data[key] = json.loads(value)
+            project_data['variables'] = [
+                json.loads(definition) for definition,
+                in self._conn.execute("SELECT definition FROM variables ORDER BY position")]
+            project_data['compiled_questionnaires'] = [
+                json.loads(definition) for definition,
+                in self._conn.execute("SELECT definition FROM questionnaires ORDER BY position")]
+
+            extracted_data = {}
+            for patient_id, error, fingerprint, result in self._conn.execute(
+                    "SELECT patient_id, error, fingerprint, result FROM extractions ORDER BY rowid"):
+                data = json.loads(result)
+                data["variables"] = {}
+                extracted_data[patient_id] = {"data": data, "error": error, "fingerprint": fingerprint}
+            for patient_id, variable, value in self._conn.execute(
+                    "SELECT patient_id, variable, value FROM extracted_values ORDER BY rowid"):
+                extracted_data[patient_id]["data"]["variables"][variable] = json.loads(value)
+        project_data['extracted_data'] = extracted_data
+        return project_data
+
+    def save(self, project_data: Dict, include_extractions: bool = True):
+        """
+        Writes the project in one transaction, so a crash leaves the previous
+        state intact. Extraction results are normally saved row by row and can
+        be left out of bulk saves (variables, settings, import).
+        """
+        with self._lock, self._conn:
+            self._write_meta(project_data)
+            self._write_variables(project_data.get('variables', []))
+            self._write_questionnaires(project_data.get('compiled_questionnaires', []))
+            if include_extractions:
+                extracted_data = project_data.get('extracted_data', {})
+                self._delete_missing("extractions", extracted_data.keys())
+                for patient_id, entry in extracted_data.items():
+                    self._write_extraction(patient_id, entry)
+
+    def save_extraction(self, patient_id: str, entry: Dict):
+        """
+        Stores one patient's extraction result and its values.
+        """
+        with self._lock, self._conn:
+            self._write_extraction(patient_id, entry)
+
+    def update_value(self, patient_id: str, variable: str, value: Any) -> bool:
+        """
+        Changes one extracted value and records the edit. Returns False if the
+        patient has no extraction result.
+        """
+        with self._lock, self._conn:
+            if self._conn.execute("SELECT 1 FROM extractions WHERE patient_id = ?", (patient_id,)).fetchone() is None:
+                return False
+            row = self._conn.execute("SELECT value FROM extracted_values WHERE patient_id = ? AND variable = ?",
+                                     (patient_id, variable)).fetchone()
+            new_value = json.dumps(value, ensure_ascii=False)
+            self._conn.execute(
+                "INSERT INTO extracted_values (patient_id, variable, value) VALUES (?, ?, ?) "
+                "ON CONFLICT(patient_id, variable) DO UPDATE SET value = excluded.value",
+                (patient_id, variable, new_value))
+            self._conn.execute(
+                "INSERT INTO edits (patient_id, variable, old_value, new_value, edited_at) VALUES (?, ?, ?, ?, ?)",
+                (patient_id, variable, row[0] if row else None, new_value, datetime.now().isoformat(timespec="seconds")))
+        return True
+
+    def get_edits(self, patient_id: Optional[str] = None) -> List[Dict]:
+        query = "SELECT patient_id, variable, old_value, new_value, edited_at FROM edits"
+        params = ()
+        if patient_id is not None:
+            query += " WHERE patient_id = ?"
+            params = (patient_id,)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY id", params).fetchall()
+        return [{"patient_id": p, "variable": v,
+                 "old_value": json.loads(old) if old is not None else None,
+                 "new_value": json.loads(new) if new is not None else None,
+                 "edited_at": at} for p, v, old, new, at in rows]
+
+    def _write_meta(self, project_data: Dict):
+        self._conn.executemany(
+            "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            [(key, json.dumps(project_data.get(key), ensure_ascii=False)) for key in META_KEYS])
+
+    def _write_variables(self, variables: List[Dict]):
+        self._conn.execute("DELETE FROM variables")
+        self._conn.executemany(
+            "INSERT INTO variables (position, name, definition) VALUES (?, ?, ?)",
+            [(position, var['name'] if isinstance(var, dict) else str(var), json.dumps(var, ensure_ascii=False))
+             for position, var in enumerate(variables)])
+
+    def _write_questionnaires(self, questionnaires: List[Dict]):
+        self._delete_missing("questionnaires", [_patient_id(q) for q in questionnaires])
+        self._conn.executemany(
+            "INSERT INTO questionnaires (patient_id, position, definition) VALUES (?, ?, ?) "
+            "ON CONFLICT(patient_id) DO UPDATE SET position = excluded.position, definition = excluded.definition",
+            [(_patient_id(q), position, json.dumps(q, ensure_ascii=False))
+             for position, q in enumerate(questionnaires)])
+
+    def _write_extraction(self, patient_id: str, entry: Dict):
+        if entry.get("data"):
+            # Stripped from the entry itself, so the text is archived once and not kept in memory
+            raw_pages = split_raw_responses(entry["data"])
+            if raw_pages:
+                entry["data"]["responses_run"] = self.responses.append(patient_id, raw_pages)
+        data = dict(entry.get("data") or {})
+        values = data.pop("variables", None) or {}
+        # Upsert rather than REPLACE, so the row keeps its place in the table order
+        self._conn.execute(
+            "INSERT INTO extractions (patient_id, error, fingerprint, result) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(patient_id) DO UPDATE SET error = excluded.error, fingerprint = excluded.fingerprint, "
+            "result = excluded.result",
+            (patient_id, entry.get("error"), entry.get("fingerprint"), json.dumps(data, ensure_ascii=False)))
+        self._conn.execute("DELETE FROM extracted_values WHERE patient_id = ?", (patient_id,))
+        self._conn.executemany(
+            "INSERT INTO extracted_values (patient_id, variable, value) VALUES (?, ?, ?)",
+            [(patient_id, variable, json.dumps(value, ensure_ascii=False)) for variable, value in values.items()])
+
+    def _delete_missing(self, table: str, keep_ids):
+        keep_ids = set(keep_ids)
+        existing = [row[0] for row in self._conn.execute(f"SELECT patient_id FROM {table}")]
+        stale = [(patient_id,) for patient_id in existing if patient_id not in keep_ids]
+        if stale:
+            self._conn.executemany(f"DELETE FROM {table} WHERE patient_id = ?", stale)
+
+    def _archive_stored_responses(self):
+        """
+        Moves the raw responses stored by earlier versions inside the
+        extraction results to the response archive, then compacts the database.
+        """
+        archived = 0
+        self.responses.start_run(MIGRATION_RUN)
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT patient_id, result FROM extractions WHERE result LIKE '%\"text\"%'").fetchall()
+            for patient_id, result in rows:
+                data = json.loads(result)
+                raw_pages = split_raw_responses(data)
+                if raw_pages:
+                    data["responses_run"] = self.responses.append(patient_id, raw_pages)
+                    archived += 1
+                self._conn.execute("UPDATE extractions SET result = ? WHERE patient_id = ?",
+                                   (json.dumps(data, ensure_ascii=False), patient_id))
+            self._conn.execute("UPDATE meta SET value = ? WHERE key = 'schema_version'",
+                               (json.dumps(SCHEMA_VERSION),))
+        self.responses.end_run()
+        if archived:
+            with self._lock:
+                self._conn.execute("VACUUM")
+            print(f"📦 Réponses brutes de {archived} patient(s) déplacées vers {self.responses.path}")
+
+    def migrate_from_json(self, json_path: str):
+        """
+        Imports a legacy project.json, then renames it so it is not imported again.
+        """
+        with open(json_path, 'r', encoding='utf-8') as f:
+            project_data = json.load(f)
+        legacy = new_project_data()
+        legacy.update(project_data)
+        self.responses.start_run(MIGRATION_RUN)
+        self.save(legacy)
+        self.responses.end_run()
+        os.replace(json_path, json_path + ".migrated")
+        print(f"📦 Projet migré vers {DATABASE_NAME} "
+              f"({len(legacy['compiled_questionnaires'])} questionnaires, {len(legacy['extracted_data'])} résultats)")
+
+
+def is_project_folder(path: str) -> bool:
+    return (os.path.exists(os.path.join(path, DATABASE_NAME))
+            or os.path.exists(os.path.join(path, LEGACY_PROJECT_FILE)))
+
+
+def open_project_store(project_path: str) -> ProjectStore:
+    """
+    Opens the project's database, migrating a legacy project.json on first open.
+    """
+    store = ProjectStore(project_path)
+    legacy_path = os.path.join(project_path, LEGACY_PROJECT_FILE)
+    if os.path.exists(legacy_path) and store.is_empty():
+        store.migrate_from_json(legacy_path)
+    return store
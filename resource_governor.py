@@ -0,0 +1,190 @@
+import threading
+import psutil
+from typing import Callable, Optional
+
+# Constants
+DEFAULT_MAX_MEMORY_PERCENT = 90
+DEFAULT_MAX_CPU_PERCENT = 90
+DEFAULT_SAMPLE_INTERVAL = 1.0  # seconds
+RESUME_MARGIN = 5  # percent below the thresholds before paused workers resume
+DEFAULT_MAX_PAUSE = 300  # seconds a worker waits for resources before going on anyway
+
+
+class ResourceWaitCancelled(Exception):
+    """
+    Raised in a worker paused for resources when its own run is cancelled.
+    """
+
+
+_local = threading.local()
+
+
+def current_cancel_event() -> Optional[threading.Event]:
+    return getattr(_local, "cancel_event", None)
+
+
+def run_cancellable(fn: Callable, cancel_event: threading.Event) -> Callable:
+    """
+    Wraps fn so that its resource waits belong to the run of cancel_event:
+    they raise ResourceWaitCancelled once that event is set, and only then.
+    """
+    def bound(*args, **kwargs):
+        previous = current_cancel_event()
+        _local.cancel_event = cancel_event
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.cancel_event = previous
+    return bound
+
+
+def bind_cancel_event(fn: Callable) -> Callable:
+    """
+    Wraps fn so that, run on a pool thread, it belongs to the caller's run.
+    """
+    cancel_event = current_cancel_event()
+    if cancel_event is None:
+        return fn
+    return run_cancellable(fn, cancel_event)
+
+
+class ResourceGovernor:
+    """
+    Samples CPU and memory usage on a background thread. Workers call
+    wait_for_capacity() before heavy work: it returns at once while the host
+    has headroom and blocks while it is overloaded, instead of raising.
+    A pause lasts at most max_pause seconds, and cancelling a run (see
+    cancel_run) releases the workers of that run only.
+    """
+
+    def __init__(self, max_memory_percent: float = DEFAULT_MAX_MEMORY_PERCENT,
+                 max_cpu_percent: float = DEFAULT_MAX_CPU_PERCENT,
+                 sample_interval: float = DEFAULT_SAMPLE_INTERVAL, max_pause: float = DEFAULT_MAX_PAUSE):
+        self.max_memory_percent = max_memory_percent
+        self.max_cpu_percent = max_cpu_percent
+        self.sample_interval = sample_interval
+        self.max_pause = max_pause
+        self.memory_percent = 0.0
+        self.cpu_percent = 0.0
+        self._overloaded = False
+        self._condition = threading.Condition()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def configure(self, max_memory_percent: Optional[float] = None, max_cpu_percent: Optional[float] = None,
+                  sample_interval: Optional[float] = None):
+        with self._condition:
+            if max_memory_percent:
+                self.max_memory_percent = max_memory_percent
+            if max_cpu_percent:
+                self.max_cpu_percent = max_cpu_percent
+            if sample_interval:
+                self.sample_interval = sample_interval
+            self._update_state()
+
+    def start(self):
+        with self._condition:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            # The first non-blocking cpu_percent() call only primes the counter
+            psutil.cpu_percent(interval=None)
+            self.memory_percent = psutil.virtual_memory().percent
+            self._update_state()
+            self._thread = threading.Thread(target=self._run, name="resource-governor", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        with self._condition:
+            self._overloaded = False
+            self._condition.notify_all()
+
+    def _run(self):
+        while not self._stop_event.wait(self.sample_interval):
+            try:
+                cpu = psutil.cpu_percent(interval=None)
+                memory = psutil.virtual_memory().percent
+            except Exception as e:
+                print(f"Error sampling system resources: {str(e)}")
+                continue
+            with self._condition:
+                self.cpu_percent = cpu
+                self.memory_percent = memory
+                self._update_state()
+
+    def _update_state(self):
+        was_overloaded = self._overloaded
+        if was_overloaded:
+            # Hysteresis, so workers do not flap around the threshold
+            self._overloaded = (self.memory_percent > self.max_memory_percent - RESUME_MARGIN
+                                or self.cpu_percent > self.max_cpu_percent - RESUME_MARGIN)
+        else:
+            self._overloaded = (self.memory_percent > self.max_memory_percent
+                                or self.cpu_percent > self.max_cpu_percent)
+        if self._overloaded and not was_overloaded:
+            print(f"⏸️ Ressources système saturées (mémoire {self.memory_percent}%, CPU {self.cpu_percent}%), "
+                  f"mise en pause des traitements...")
+        elif was_overloaded and not self._overloaded:
+            print("▶️ Ressources système disponibles, reprise des traitements.")
+            self._condition.notify_all()
+
+    @property
+    def overloaded(self) -> bool:
+        return self._overloaded
+
+    def wake_waiters(self):
+        """
+        Makes paused workers check their run's cancel event again.
+        """
+        with self._condition:
+            self._condition.notify_all()
+
+    def wait_for_capacity(self, timeout: Optional[float] = None) -> bool:
+        """
+        Blocks while the host is overloaded, at most timeout seconds
+        (max_pause by default). Returns False if the host was still
+        overloaded when the wait ended. Raises ResourceWaitCancelled if the
+        calling thread's run is cancelled, before or during the wait.
+        """
+        cancel_event = current_cancel_event()
+        cancelled = cancel_event.is_set if cancel_event is not None else (lambda: False)
+        self.start()
+        with self._condition:
+            if not self._overloaded and not cancelled():
+                return True
+            available = self._condition.wait_for(lambda: not self._overloaded or cancelled(),
+                                                 timeout=self.max_pause if timeout is None else timeout)
+            if cancelled():
+                raise ResourceWaitCancelled("Traitement annulé pendant l'attente de ressources.")
+            if not available:
+                print(f"⚠️ Ressources toujours saturées après {self.max_pause if timeout is None else timeout} s, "
+                      f"reprise malgré tout.")
+            return available
+
+
+_governor = ResourceGovernor()
+
+
+def get_resource_governor() -> ResourceGovernor:
+    return _governor
+
+
+def configure_resource_governor(max_memory_percent: Optional[float] = None,
+                                max_cpu_percent: Optional[float] = None,
+                                sample_interval: Optional[float] = None):
+    _governor.configure(max_memory_percent=max_memory_percent, max_cpu_percent=max_cpu_percent,
+                        sample_interval=sample_interval)
+
+
+def wait_for_resources(timeout: Optional[float] = None) -> bool:
+    return _governor.wait_for_capacity(timeout=timeout)
+
+
+def cancel_run(cancel_event: threading.Event):
+    """
+    Cancels the run of cancel_event: its workers paused for resources stop
+    waiting. Other callers are not affected.
+    """
+    cancel_event.set()
+    _governor.wake_waiters()
@@ -0,0 +1,127 @@
+import os
+import json
+import gzip
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# Constants
+ARCHIVE_DIR = "responses"
+INDEX_FILE = "index.jsonl"
+SEGMENT_PREFIX = "responses_"
+SEGMENT_SUFFIX = ".jsonl.gz"
+
+
+class ResponseArchive:
+    """
+    Raw model responses, kept out of the project database. Each run appends
+    to its own gzip file, one compressed member per patient, and an index
+    line records where it is; reading a patient's responses decompresses
+    that member only. Nothing is ever rewritten.
+    """
+
+    def __init__(self, project_path: str):
+        self.path = os.path.join(project_path, ARCHIVE_DIR)
+        self.run_id = None
+        self._index = None
+        self._lock = threading.Lock()
+
+    def start_run(self, run_id: Optional[str] = None) -> str:
+        """
+        Responses appended from now on go to a new run.
+        """
+        with self._lock:
+            self.run_id = run_id or datetime.now().strftime('%Y%m%d_%H%M%S')
+            return self.run_id
+
+    def end_run(self):
+        """
+        The next append starts a new run, named after its time.
+        """
+        with self._lock:
+            self.run_id = None
+
+    def append(self, patient_id: str, pages: List[Dict]) -> Optional[str]:
+        """
+        Archives the raw responses of one patient, a list of
+        {"filename", "text"}. Returns the run they were stored under.
+        """
+        if not pages:
+            return None
+        record = json.dumps({"patient_id": patient_id, "pages": pages}, ensure_ascii=False)
+        member = gzip.compress(record.encode("utf-8"))
+        with self._lock:
+            if self.run_id is None:
+                self.run_id = datetime.now().strftime('%Y%m%d_%H%M%S')
+            os.makedirs(self.path, exist_ok=True)
+            segment = f"{SEGMENT_PREFIX}{self.run_id}{SEGMENT_SUFFIX}"
+            with open(os.path.join(self.path, segment), 'ab') as f:
+                offset = f.tell()
+                f.write(member)
+            entry = {"patient_id": patient_id, "run": self.run_id, "file": segment,
+                     "offset": offset, "length": len(member)}
+            # Index written after the data: a crash in between loses the entry, never points at garbage
+            with open(os.path.join(self.path, INDEX_FILE), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            if self._index is not None:
+                self._index.setdefault(patient_id, []).append(entry)
+            return self.run_id
+
+    def _load_index(self) -> Dict[str, List[Dict]]:
+        if self._index is None:
+            index = {}
+            try:
+                with open(os.path.join(self.path, INDEX_FILE), 'r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except json.JSONDecodeError:
+                            continue  # line cut short by a crash
+                        index.setdefault(entry["patient_id"], []).append(entry)
+            except OSError:
+                pass
+            self._index = index
+        return self._index
+
+    def runs(self, patient_id: str) -> List[str]:
+        with self._lock:
+            return [entry["run"] for entry in self._load_index().get(patient_id, [])]
+
+    def get(self, patient_id: str, run: Optional[str] = None) -> List[Dict]:
+        """
+        Returns the raw responses of a patient for a run, by default the
+        latest one; an empty list if none were archived.
+        """
+        with self._lock:
+            entries = self._load_index().get(patient_id, [])
+            if run is not None:
+                entries = [entry for entry in entries if entry["run"] == run]
+            if not entries:
+                return []
+            entry = entries[-1]
+            try:
+                with open(os.path.join(self.path, entry["file"]), 'rb') as f:
+                    f.seek(entry["offset"])
+                    member = f.read(entry["length"])
+                return json.loads(gzip.decompress(member).decode("utf-8"))["pages"]
+            except (OSError, EOFError, gzip.BadGzipFile, json.JSONDecodeError, KeyError):
+                return []
+
+
+def split_raw_responses(data: Dict) -> List[Dict]:
+    """
+    Removes the raw response text (and its JSON-serialized copy) from the
+    pages of an extraction result and returns it for the archive.
+    """
+    raw_pages = []
+    stored_pages = []
+    for page in data.get("pages") or []:
+        page = dict(page)
+        text = page.pop("text", None)
+        page.pop("structured", None)
+        if text:
+            raw_pages.append({"filename": page.get("filename"), "text": text})
+        stored_pages.append(page)
+    if "pages" in data:
+        data["pages"] = stored_pages
+    return raw_pages
@@ -0,0 +1,110 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+# Constants
+DEFAULT_CACHE_MAX_BYTES = 512 * 1024 * 1024  # 512MB
+CACHE_FILE_SUFFIX = ".json"
+
+
+class ResponseCache:
+    """
+    Persistent cache of vision-model responses, stored as one small JSON file
+    per response. Entries are keyed by a hash of the request payload and
+    evicted in least-recently-used order once the size cap is reached.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> file size, oldest first
+        self._total_bytes = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    @staticmethod
+    def make_key(payload: Dict) -> str:
+        """
+        Hashes the encoded image, the exact prompt and the model parameters.
+        """
+        digest = hashlib.sha256()
+        digest.update(payload.get("image_base64", "").encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(payload.get("prompt", "").encode("utf-8"))
+        digest.update(b"\0")
+        params = {k: payload.get(k) for k in ("max_tokens", "temperature")}
+        digest.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + CACHE_FILE_SUFFIX)
+
+    def _load_index(self):
+        # The modification time of each file records its last use
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(CACHE_FILE_SUFFIX):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            files.append((stat.st_mtime, name[:-len(CACHE_FILE_SUFFIX)], stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._total_bytes += size
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            if key not in self._entries:
+                return None
+            path = self._path(key)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    text = json.load(f)["text"]
+                os.utime(path)
+            except (OSError, ValueError, KeyError):
+                self._forget(key)
+                return None
+            self._entries.move_to_end(key)
+            return text
+
+    def put(self, key: str, text: str):
+        with self._lock:
+            path = self._path(key)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump({"text": text}, f, ensure_ascii=False)
+                os.replace(tmp_path, path)
+                size = os.path.getsize(path)
+            except OSError as e:
+                print(f"Error writing response cache entry: {str(e)}")
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                return
+            self._total_bytes -= self._entries.pop(key, 0)
+            self._entries[key] = size
+            self._total_bytes += size
+            self._evict()
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            oldest_key = next(iter(self._entries))
+            self._forget(oldest_key)
+
+    def _forget(self, key: str):
+        self._total_bytes -= self._entries.pop(key, 0)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._forget(key)
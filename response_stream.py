@@ -0,0 +1,210 @@
+import json
+import codecs
+import queue
+import socket
+import threading
+import requests
+import urllib3
+from time import monotonic
+from typing import Callable, Iterator, Optional
+
+# Constants
+DEFAULT_STALL_TIMEOUT = 30  # seconds between two chunks, once tokens flow, before a stream is aborted
+SSE_DONE = "[DONE]"
+STREAM_READ_SIZE = 8192  # bytes asked per socket read; whatever has arrived is returned
+_END_OF_STREAM = object()
+
+
+class JsonStreamAssembler:
+    """
+    Follows the generated text chunk by chunk and tells when the first
+    top-level JSON object is complete, so the request can end right there.
+    Braces inside strings, and escaped quotes, are skipped.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.depth = 0
+        self.started = False
+        self.complete = False
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, chunk: str) -> bool:
+        """
+        Adds a chunk; returns True once the top-level object has closed.
+        Text after the closing brace is dropped.
+        """
+        if self.complete:
+            return True
+        for i, char in enumerate(chunk):
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"' and self.started:
+                self._in_string = True
+            elif char == "{":
+                self.started = True
+                self.depth += 1
+            elif char == "}" and self.started:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.complete = True
+                    self.parts.append(chunk[:i + 1])
+                    return True
+        self.parts.append(chunk)
+        return False
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+
+def _iter_body_text(response: requests.Response) -> Iterator[str]:
+    """
+    Yields the body as it arrives. iter_content / iter_lines wait for a full
+    buffer (or the end of an unchunked body) before yielding, which would
+    hold back the first tokens and hide a stall.
+    """
+    read1 = getattr(response.raw, "read1", None)
+    if read1 is None:  # urllib3 < 2.3
+        yield from response.iter_content(chunk_size=1, decode_unicode=True)
+        return
+    decoder = codecs.getincrementaldecoder(response.encoding)(errors="replace")
+    try:
+        while True:
+            data = read1(STREAM_READ_SIZE)
+            if not data:
+                break
+            text = decoder.decode(data)
+            if text:
+                yield text
+    except (urllib3.exceptions.HTTPError, OSError) as e:
+        raise requests.exceptions.ConnectionError(e) from e
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def _iter_lines(response: requests.Response) -> Iterator[str]:
+    pending = ""
+    for text in _iter_body_text(response):
+        pending += text
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    if pending:
+        yield pending.rstrip("\r")
+
+
+def iter_stream_text(response: requests.Response) -> Iterator[str]:
+    """
+    Yields the generated text of a streamed response: server-sent events
+    ("data: {...}" lines, ending with "data: [DONE]") or plain chunked text.
+    """
+    content_type = response.headers.get("Content-Type", "")
+    if "charset" not in content_type:
+        # requests falls back to ISO-8859-1 for text/*; event streams are always UTF-8
+        response.encoding = "utf-8"
+    if "text/event-stream" not in content_type:
+        yield from _iter_body_text(response)
+        return
+    for line in _iter_lines(response):
+        if not line or not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == SSE_DONE:
+            return
+        try:
+            event = json.loads(data)
+        except json.JSONDecodeError:
+            yield data
+            continue
+        if event.get("error"):
+            raise requests.HTTPError(f"Erreur du flux : {event['error']}", response=response)
+        yield event.get("text") or event.get("token") or ""
+
+
+def _read_chunks(response: requests.Response, chunks: queue.Queue, stop: threading.Event):
+    try:
+        for chunk in iter_stream_text(response):
+            if stop.is_set():
+                return
+            chunks.put(chunk)
+    except Exception as e:
+        chunks.put(e)
+        return
+    chunks.put(_END_OF_STREAM)
+
+
+def _abort(response: requests.Response, reader: threading.Thread):
+    """
+    Closes a streamed response, even while the reader thread is blocked on
+    the socket: closing alone would wait for that read (up to the read
+    timeout), so the socket is shut down first to wake it.
+    """
+    if reader.is_alive():
+        # http.client response -> buffered socket file -> socket
+        sock = getattr(getattr(getattr(getattr(response.raw, "_fp", None), "fp", None), "raw", None), "_sock", None)
+        if sock is None:
+            threading.Thread(target=response.close, daemon=True).start()
+            return
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    response.close()
+
+
+def read_streamed_json(response: requests.Response, max_duration: Optional[float] = None,
+                       on_first_byte: Optional[Callable[[], None]] = None,
+                       stall_timeout: Optional[float] = None) -> str:
+    """
+    Reads a streamed response until its top-level JSON object closes, then
+    drops the connection. Until the first token, only the request's read
+    timeout applies (the server may be queueing or prefilling); after it, a
+    gap of stall_timeout seconds between chunks aborts the stream.
+    max_duration bounds the whole generation.
+    """
+    assembler = JsonStreamAssembler()
+    started = monotonic()
+    first = True
+    chunks = queue.Queue()
+    stop = threading.Event()
+    # Read on a helper thread so that the wait between chunks can be bounded here
+    reader = threading.Thread(target=_read_chunks, args=(response, chunks, stop), daemon=True,
+                              name="stream-reader")
+    reader.start()
+    try:
+        while True:
+            wait = None if first else stall_timeout
+            if max_duration:
+                remaining = max(0.0, max_duration - (monotonic() - started))
+                wait = remaining if wait is None else min(wait, remaining)
+            try:
+                chunk = chunks.get(timeout=wait)
+            except queue.Empty:
+                if max_duration and monotonic() - started >= max_duration:
+                    raise requests.Timeout(f"Génération trop longue (plus de {max_duration} s)")
+                raise requests.Timeout(f"Flux interrompu, plus aucun token reçu depuis {stall_timeout} s")
+            if chunk is _END_OF_STREAM:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            if first and chunk:
+                first = False
+                if on_first_byte:
+                    on_first_byte()
+            if assembler.feed(chunk):
+                break
+    except requests.exceptions.ConnectionError as e:
+        # A read timeout while streaming surfaces as a connection error
+        raise requests.Timeout(f"Flux interrompu, plus aucun token reçu : {str(e)}") from e
+    finally:
+        stop.set()
+        _abort(response, reader)
+    return assembler.text
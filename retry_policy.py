@@ -0,0 +1,176 @@
+import random
+import threading
+import requests
+from collections import deque
+from time import sleep, monotonic
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable, Optional, Tuple
+
+# Constants
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_BASE_DELAY = 2  # seconds
+DEFAULT_MAX_DELAY = 60  # seconds
+MAX_RETRY_AFTER = 300  # seconds, upper bound for a server-requested delay
+DEFAULT_BREAKER_THRESHOLD = 5  # consecutive failures before the circuit opens
+DEFAULT_BREAKER_COOLDOWN = 60  # seconds before a trial request is let through
+RETRYABLE_STATUS_CODES = (408, 425, 429, 500, 502, 503, 504)
+RECENT_FAILURES_KEPT = 64  # failures remembered to count a shared batch failure once
+
+
+class VisionRequestError(Exception):
+    """
+    Raised when a vision request failed for good, with the last underlying error.
+    """
+
+    def __init__(self, message: str, retryable: bool = False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parses a Retry-After header, given either in seconds or as an HTTP date.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def classify_error(error: Exception) -> Tuple[bool, Optional[float]]:
+    """
+    Returns (retryable, retry_after). Timeouts, connection errors, 429 and 5xx
+    responses are worth retrying; other client errors are fatal.
+    """
+    if isinstance(error, (requests.Timeout, requests.ConnectionError)):
+        return True, None
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        if status in RETRYABLE_STATUS_CODES:
+            return True, parse_retry_after(error.response.headers.get("Retry-After"))
+        return False, None
+    if isinstance(error, requests.exceptions.JSONDecodeError):
+        # A proxy error page instead of the model's JSON body
+        return True, None
+    return False, None
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts: int = DEFAULT_MAX_ATTEMPTS, base_delay: float = DEFAULT_BASE_DELAY,
+                 max_delay: float = DEFAULT_MAX_DELAY):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """
+        Exponential backoff with full jitter; a Retry-After from the server is
+        used as a lower bound.
+        """
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, MAX_RETRY_AFTER))
+        return delay
+
+
+class CircuitBreaker:
+    """
+    Opens after repeated consecutive failures. While open, callers wait
+    instead of hitting the endpoint; after the cooldown a single trial request
+    is let through, and its outcome closes or re-opens the circuit.
+    Failures are counted per HTTP call: when a batched call fails, every
+    caller of the batch reports the same exception, which counts once.
+    """
+
+    def __init__(self, failure_threshold: int = DEFAULT_BREAKER_THRESHOLD,
+                 cooldown: float = DEFAULT_BREAKER_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._recent_failures = deque(maxlen=RECENT_FAILURES_KEPT)
+        self._condition = threading.Condition()
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    def before_call(self):
+        with self._condition:
+            while self._opened_at is not None:
+                remaining = self._opened_at + self.cooldown - monotonic()
+                if remaining <= 0 and not self._trial_running:
+                    self._trial_running = True
+                    return
+                self._condition.wait(timeout=remaining if remaining > 0 else 1.0)
+
+    def record_success(self):
+        with self._condition:
+            if self._opened_at is not None:
+                print("✅ Le modèle de vision répond de nouveau, reprise des traitements.")
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+            self._condition.notify_all()
+
+    def cancel_trial(self):
+        with self._condition:
+            self._trial_running = False
+            self._condition.notify_all()
+
+    def record_failure(self, error: Optional[Exception] = None):
+        with self._condition:
+            if error is not None:
+                if any(error is seen for seen in self._recent_failures):
+                    return
+                self._recent_failures.append(error)
+            self._failures += 1
+            if self._trial_running or (self._opened_at is None and self._failures >= self.failure_threshold):
+                print(f"⛔ Le modèle de vision ne répond plus ({self._failures} échecs consécutifs), "
+                      f"pause de {self.cooldown} s avant un nouvel essai...")
+                self._opened_at = monotonic()
+            self._trial_running = False
+            self._condition.notify_all()
+
+
+def call_with_retries(fn: Callable, policy: RetryPolicy, breaker: Optional[CircuitBreaker] = None,
+                      on_retry: Optional[Callable[[int, Exception, float], None]] = None):
+    """
+    Calls fn until it succeeds, a fatal error occurs or the attempts run out.
+    Raises VisionRequestError with the last error in the two latter cases.
+    """
+    for attempt in range(policy.max_attempts):
+        if breaker:
+            breaker.before_call()
+        try:
+            result = fn()
+        except Exception as e:
+            retryable, retry_after = classify_error(e)
+            if breaker and retryable:
+                breaker.record_failure(e)
+            elif breaker and isinstance(e, requests.HTTPError):
+                # A rejected request still proves the endpoint is up
+                breaker.record_success()
+            elif breaker:
+                breaker.cancel_trial()
+            if not retryable or attempt == policy.max_attempts - 1:
+                raise VisionRequestError(str(e), retryable=retryable) from e
+            delay = policy.backoff(attempt, retry_after)
+            if on_retry:
+                on_retry(attempt, e, delay)
+            sleep(delay)
+            continue
+        if breaker:
+            breaker.record_success()
+        return result
+    raise VisionRequestError("Aucune tentative n'a été effectuée.")
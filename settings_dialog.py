@@ -0,0 +1,250 @@
+from PyQt5.QtWidgets import QDialog, QFormLayout, QSpinBox, QLineEdit, QCheckBox, QComboBox, QDialogButtonBox
+from extraction_engine import get_extraction_settings, MAX_WORKERS_LIMIT
+
+MERGE_MODES = [
+    ("streaming", "Réduction page par page (mémoire limitée)"),
+    ("full", "Pleine résolution puis réduction"),
+]
+
+IMAGE_FORMATS = [
+    ("PNG", "PNG (sans perte)"),
+    ("JPEG", "JPEG"),
+    ("WEBP", "WebP"),
+]
+
+IMPORT_MODES = [
+    ("auto", "Liens sans copie si possible, sinon copie"),
+    ("copy", "Toujours copier les fichiers"),
+]
+
+EXTRACTION_MODES = [
+    ("merged", "Une requête avec toutes les pages fusionnées"),
+    ("per_page", "Une requête par page (ou groupe de pages)"),
+]
+
+
+class ExtractionSettingsDialog(QDialog):
+    def __init__(self, project_data, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Paramètres d'extraction")
+        self.setMinimumWidth(420)
+        self.settings = get_extraction_settings(project_data)
+
+        self.layout = QFormLayout(self)
+
+        self.workers_input = QSpinBox()
+        self.workers_input.setRange(1, MAX_WORKERS_LIMIT)
+        self.workers_input.setValue(int(self.settings["max_workers"]))
+        self.workers_input.setToolTip("Nombre de patients traités en parallèle par le modèle de vision")
+        self.layout.addRow("Patients en parallèle :", self.workers_input)
+
+        self.endpoint_input = QLineEdit(self.settings["vision_endpoint"])
+        self.endpoint_input.setPlaceholderText("Point d'accès par défaut")
+        self.layout.addRow("Point d'accès du modèle :", self.endpoint_input)
+
+        self.pool_size_input = QSpinBox()
+        self.pool_size_input.setRange(1, 128)
+        self.pool_size_input.setValue(int(self.settings["pool_size"]))
+        self.pool_size_input.setToolTip("Nombre maximal de connexions HTTP ouvertes vers le modèle")
+        self.layout.addRow("Connexions HTTP :", self.pool_size_input)
+
+        self.connect_timeout_input = QSpinBox()
+        self.connect_timeout_input.setRange(1, 120)
+        self.connect_timeout_input.setSuffix(" s")
+        self.connect_timeout_input.setValue(int(self.settings["connect_timeout"]))
+        self.layout.addRow("Délai de connexion :", self.connect_timeout_input)
+
+        self.read_timeout_input = QSpinBox()
+        self.read_timeout_input.setRange(10, 1800)
+        self.read_timeout_input.setSuffix(" s")
+        self.read_timeout_input.setValue(int(self.settings["read_timeout"]))
+        self.layout.addRow("Délai de réponse :", self.read_timeout_input)
+
+        self.streaming_input = QCheckBox("Lire la réponse au fil de la génération (flux)")
+        self.streaming_input.setChecked(bool(self.settings["streaming_enabled"]))
+        self.streaming_input.setToolTip("Nécessite un serveur qui accepte \"stream\": true ; sans effet avec le regroupement")
+        self.layout.addRow("Réponses en flux :", self.streaming_input)
+
+        self.stall_timeout_input = QSpinBox()
+        self.stall_timeout_input.setRange(5, 600)
+        self.stall_timeout_input.setSuffix(" s")
+        self.stall_timeout_input.setValue(int(self.settings["stall_timeout"]))
+        self.stall_timeout_input.setToolTip("Une requête qui, après ses premiers tokens, n'en produit plus aucun pendant ce délai est relancée")
+        self.layout.addRow("Abandon si flux bloqué après :", self.stall_timeout_input)
+
+        self.batching_input = QCheckBox("Regrouper les requêtes de plusieurs patients")
+        self.batching_input.setChecked(bool(self.settings["batching_enabled"]))
+        self.batching_input.setToolTip("Le serveur doit proposer un point d'accès par lots (/generate_batch)")
+        self.layout.addRow("Envoi par lots :", self.batching_input)
+
+        self.batch_size_input = QSpinBox()
+        self.batch_size_input.setRange(2, 128)
+        self.batch_size_input.setValue(int(self.settings["batch_size"]))
+        self.layout.addRow("Requêtes par lot :", self.batch_size_input)
+
+        self.batch_wait_input = QSpinBox()
+        self.batch_wait_input.setRange(0, 5000)
+        self.batch_wait_input.setSuffix(" ms")
+        self.batch_wait_input.setValue(int(self.settings["batch_max_wait_ms"]))
+        self.batch_wait_input.setToolTip("Attente maximale pour compléter un lot avant de l'envoyer")
+        self.layout.addRow("Attente maximale d'un lot :", self.batch_wait_input)
+
+        self.batch_endpoint_input = QLineEdit(self.settings["batch_endpoint"])
+        self.batch_endpoint_input.setPlaceholderText("Point d'accès du modèle + _batch")
+        self.layout.addRow("Point d'accès par lots :", self.batch_endpoint_input)
+
+        self.max_attempts_input = QSpinBox()
+        self.max_attempts_input.setRange(1, 20)
+        self.max_attempts_input.setValue(int(self.settings["max_attempts"]))
+        self.max_attempts_input.setToolTip("Les erreurs définitives (requête invalide) ne sont jamais réessayées")
+        self.layout.addRow("Tentatives par requête :", self.max_attempts_input)
+
+        self.breaker_threshold_input = QSpinBox()
+        self.breaker_threshold_input.setRange(1, 100)
+        self.breaker_threshold_input.setValue(int(self.settings["breaker_threshold"]))
+        self.breaker_threshold_input.setToolTip("Échecs consécutifs avant de suspendre les appels au modèle")
+        self.layout.addRow("Pause après échecs consécutifs :", self.breaker_threshold_input)
+
+        self.breaker_cooldown_input = QSpinBox()
+        self.breaker_cooldown_input.setRange(5, 3600)
+        self.breaker_cooldown_input.setSuffix(" s")
+        self.breaker_cooldown_input.setValue(int(self.settings["breaker_cooldown"]))
+        self.layout.addRow("Durée de la pause :", self.breaker_cooldown_input)
+
+        self.cache_enabled_input = QCheckBox("Réutiliser les réponses déjà obtenues")
+        self.cache_enabled_input.setChecked(bool(self.settings["cache_enabled"]))
+        self.layout.addRow("Cache des réponses :", self.cache_enabled_input)
+
+        self.cache_size_input = QSpinBox()
+        self.cache_size_input.setRange(16, 65536)
+        self.cache_size_input.setSuffix(" Mo")
+        self.cache_size_input.setValue(int(self.settings["cache_max_mb"]))
+        self.layout.addRow("Taille maximale du cache :", self.cache_size_input)
+
+        self.merge_mode_input = QComboBox()
+        for mode, label in MERGE_MODES:
+            self.merge_mode_input.addItem(label, mode)
+        self.merge_mode_input.setCurrentIndex(max(0, self.merge_mode_input.findData(self.settings["merge_mode"])))
+        self.layout.addRow("Fusion des pages :", self.merge_mode_input)
+
+        self.image_format_input = QComboBox()
+        for image_format, label in IMAGE_FORMATS:
+            self.image_format_input.addItem(label, image_format)
+        self.image_format_input.setCurrentIndex(max(0, self.image_format_input.findData(self.settings["image_format"])))
+        self.layout.addRow("Format des images envoyées :", self.image_format_input)
+
+        self.image_quality_input = QSpinBox()
+        self.image_quality_input.setRange(10, 100)
+        self.image_quality_input.setValue(int(self.settings["image_quality"]))
+        self.layout.addRow("Qualité (JPEG / WebP) :", self.image_quality_input)
+
+        self.extraction_mode_input = QComboBox()
+        for mode, label in EXTRACTION_MODES:
+            self.extraction_mode_input.addItem(label, mode)
+        self.extraction_mode_input.setCurrentIndex(
+            max(0, self.extraction_mode_input.findData(self.settings["extraction_mode"])))
+        self.layout.addRow("Mode d'extraction :", self.extraction_mode_input)
+
+        self.pages_per_request_input = QSpinBox()
+        self.pages_per_request_input.setRange(1, 100)
+        self.pages_per_request_input.setValue(int(self.settings["pages_per_request"]))
+        self.layout.addRow("Pages par requête :", self.pages_per_request_input)
+
+        self.parallel_requests_input = QSpinBox()
+        self.parallel_requests_input.setRange(1, 32)
+        self.parallel_requests_input.setValue(int(self.settings["max_parallel_requests"]))
+        self.parallel_requests_input.setToolTip("Nombre de requêtes envoyées en parallèle pour un même patient")
+        self.layout.addRow("Requêtes par patient :", self.parallel_requests_input)
+
+        self.chunk_size_input = QSpinBox()
+        self.chunk_size_input.setRange(0, 1000)
+        self.chunk_size_input.setSpecialValueText("Toutes")
+        self.chunk_size_input.setValue(int(self.settings["variable_chunk_size"]))
+        self.chunk_size_input.setToolTip("Nombre de variables demandées par requête (0 : toutes en une fois)")
+        self.layout.addRow("Variables par requête :", self.chunk_size_input)
+
+        self.requery_input = QCheckBox("Redemander uniquement les variables manquantes ou invalides")
+        self.requery_input.setChecked(bool(self.settings["requery_missing"]))
+        self.requery_input.setToolTip("Une requête courte sur la même image, au lieu de relancer tout le patient")
+        self.layout.addRow("Relance ciblée :", self.requery_input)
+
+        self.batching_input.toggled.connect(self.update_mode_visibility)
+        self.streaming_input.toggled.connect(self.update_mode_visibility)
+        self.image_format_input.currentIndexChanged.connect(self.update_mode_visibility)
+        self.extraction_mode_input.currentIndexChanged.connect(self.update_mode_visibility)
+        self.update_mode_visibility()
+
+        self.max_memory_input = QSpinBox()
+        self.max_memory_input.setRange(50, 99)
+        self.max_memory_input.setSuffix(" %")
+        self.max_memory_input.setValue(int(self.settings["max_memory_percent"]))
+        self.max_memory_input.setToolTip("Au-delà, les traitements sont mis en pause jusqu'à ce que la mémoire se libère")
+        self.layout.addRow("Pause si mémoire au-delà de :", self.max_memory_input)
+
+        self.max_cpu_input = QSpinBox()
+        self.max_cpu_input.setRange(50, 100)
+        self.max_cpu_input.setSuffix(" %")
+        self.max_cpu_input.setValue(int(self.settings["max_cpu_percent"]))
+        self.layout.addRow("Pause si CPU au-delà de :", self.max_cpu_input)
+
+        self.import_mode_input = QComboBox()
+        for mode, label in IMPORT_MODES:
+            self.import_mode_input.addItem(label, mode)
+        self.import_mode_input.setCurrentIndex(max(0, self.import_mode_input.findData(self.settings["import_mode"])))
+        self.layout.addRow("Importation des scans :", self.import_mode_input)
+
+        self.debug_output_input = QCheckBox("Afficher les réponses brutes du modèle dans la console")
+        self.debug_output_input.setChecked(bool(self.settings["debug_output"]))
+        self.layout.addRow("Débogage :", self.debug_output_input)
+
+        self.button_box = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        self.button_box.accepted.connect(self.accept)
+        self.button_box.rejected.connect(self.reject)
+        self.layout.addRow(self.button_box)
+
+    def update_mode_visibility(self):
+        per_page = self.extraction_mode_input.currentData() == "per_page"
+        self.pages_per_request_input.setVisible(per_page)
+        self.layout.labelForField(self.pages_per_request_input).setVisible(per_page)
+        streaming = self.streaming_input.isChecked()
+        self.stall_timeout_input.setVisible(streaming)
+        self.layout.labelForField(self.stall_timeout_input).setVisible(streaming)
+        batching = self.batching_input.isChecked()
+        for field in (self.batch_size_input, self.batch_wait_input, self.batch_endpoint_input):
+            field.setVisible(batching)
+            self.layout.labelForField(field).setVisible(batching)
+        lossy = self.image_format_input.currentData() != "PNG"
+        self.image_quality_input.setVisible(lossy)
+        self.layout.labelForField(self.image_quality_input).setVisible(lossy)
+
+    def get_settings(self):
+        settings = dict(self.settings)
+        settings["max_workers"] = self.workers_input.value()
+        settings["vision_endpoint"] = self.endpoint_input.text().strip()
+        settings["pool_size"] = self.pool_size_input.value()
+        settings["connect_timeout"] = self.connect_timeout_input.value()
+        settings["read_timeout"] = self.read_timeout_input.value()
+        settings["streaming_enabled"] = self.streaming_input.isChecked()
+        settings["stall_timeout"] = self.stall_timeout_input.value()
+        settings["batching_enabled"] = self.batching_input.isChecked()
+        settings["batch_size"] = self.batch_size_input.value()
+        settings["batch_max_wait_ms"] = self.batch_wait_input.value()
+        settings["batch_endpoint"] = self.batch_endpoint_input.text().strip()
+        settings["max_attempts"] = self.max_attempts_input.value()
+        settings["breaker_threshold"] = self.breaker_threshold_input.value()
+        settings["breaker_cooldown"] = self.breaker_cooldown_input.value()
+        settings["cache_enabled"] = self.cache_enabled_input.isChecked()
+        settings["cache_max_mb"] = self.cache_size_input.value()
+        settings["merge_mode"] = self.merge_mode_input.currentData()
+        settings["image_format"] = self.image_format_input.currentData()
+        settings["image_quality"] = self.image_quality_input.value()
+        settings["extraction_mode"] = self.extraction_mode_input.currentData()
+        settings["pages_per_request"] = self.pages_per_request_input.value()
+        settings["max_parallel_requests"] = self.parallel_requests_input.value()
+        settings["variable_chunk_size"] = self.chunk_size_input.value()
+        settings["requery_missing"] = self.requery_input.isChecked()
+        settings["max_memory_percent"] = self.max_memory_input.value()
+        settings["max_cpu_percent"] = self.max_cpu_input.value()
+        settings["import_mode"] = self.import_mode_input.currentData()
+        settings["debug_output"] = self.debug_output_input.isChecked()
+        return settings
@@ -1,24 +1,152 @@
 from PyQt5.QtWidgets import (
-    QWidget, QHBoxLayout, QTableWidget, QTableWidgetItem,
+    QWidget, QHBoxLayout, QTableView, QHeaderView, QAbstractItemView,
     QLabel, QVBoxLayout, QPushButton, QScrollArea,
-    QSplitter, QFrame, QSizePolicy, QMessageBox
+    QSplitter, QFrame, QSizePolicy, QMessageBox, QDialog, QPlainTextEdit, QDialogButtonBox
 )
 from PyQt5.QtGui import QPixmap, QColor, QFont, QIcon
-from PyQt5.QtCore import Qt, QRect, QPoint
+from PyQt5.QtCore import Qt, QRect, QPoint, QAbstractTableModel, QModelIndex
 import os
-import re
+from page_cache import PageCache
+
+# Constants
+COLUMN_SIZE_SAMPLE_ROWS = 200  # rows looked at when sizing columns to their content
+ROW_HEIGHT = 36
+ATTENTION_COLOR = QColor("#fce8e6")  # Soft red for attention
+ZOOM_STEP = 25
+MIN_ZOOM = 50
+MAX_ZOOM = 300
+
+
+class VerificationTableModel(QAbstractTableModel):
+    """
+    Table of extracted values read lazily from project_data['extracted_data']:
+    the view only asks for the cells it paints, so no per-cell widget is
+    ever created. Edits go back into the project data and to save_callback.
+    """
+
+    def __init__(self, project_data, save_callback, parent=None):
+        super().__init__(parent)
+        self.save_callback = save_callback
+        self.project_data = {}
+        self.patient_ids = []
+        self.variable_names = []
+        self.set_project_data(project_data)
+
+    def set_project_data(self, project_data):
+        self.beginResetModel()
+        self.project_data = project_data or {}
+        self.patient_ids = list(self.project_data.get('extracted_data', {}).keys())
+        self.variable_names = [v['name'] if isinstance(v, dict) else str(v)
+                               for v in self.project_data.get('variables', [])]
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.patient_ids)
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid() or not self.patient_ids:
+            return 0
+        return len(self.variable_names) + 2
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Vertical:
+            return section + 1
+        if section == 0:
+            return "Patient"
+        if section == len(self.variable_names) + 1:
+            return "Erreurs"
+        return self.variable_names[section - 1]
+
+    def patient_id(self, row):
+        return self.patient_ids[row]
+
+    def _entry(self, row):
+        return self.project_data['extracted_data'].get(self.patient_ids[row], {})
+
+    def _errors(self, entry):
+        data = entry.get("data") or {}
+        errors = "\n".join(data.get("errors", []))
+        if entry.get("error"):
+            errors += f"\n{entry['error']}"
+        return errors
+
+    def _value(self, entry, column):
+        variables = (entry.get("data") or {}).get("variables", {})
+        return str(variables.get(self.variable_names[column - 1], ""))
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row, column = index.row(), index.column()
+        if column == 0:
+            return self.patient_ids[row] if role in (Qt.DisplayRole, Qt.EditRole) else None
+        entry = self._entry(row)
+        if column == len(self.variable_names) + 1:
+            return self._errors(entry) if role in (Qt.DisplayRole, Qt.ToolTipRole) else None
+        if role in (Qt.DisplayRole, Qt.EditRole):
+            return self._value(entry, column)
+        if role == Qt.BackgroundRole and '?' in self._value(entry, column):
+            return ATTENTION_COLOR
+        return None
+
+    def flags(self, index):
+        flags = super().flags(index)
+        if index.isValid() and 0 < index.column() <= len(self.variable_names):
+            flags |= Qt.ItemIsEditable
+        return flags
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if role != Qt.EditRole or not (self.flags(index) & Qt.ItemIsEditable):
+            return False
+        patient_id = self.patient_ids[index.row()]
+        var_name = self.variable_names[index.column() - 1]
+        new_value = str(value)
+        try:
+            entry = self.project_data['extracted_data'][patient_id]
+            entry["data"].setdefault("variables", {})[var_name] = new_value
+            self.save_callback(patient_id, var_name, new_value)
+        except Exception as e:
+            print(f"Error saving change: {e}")
+            return False
+        self.dataChanged.emit(index, index, [Qt.DisplayRole, Qt.EditRole, Qt.BackgroundRole])
+        return True
+
+
+class RawResponseDialog(QDialog):
+    """Read-only view of the archived raw model responses of one patient"""
+
+    def __init__(self, patient_id, pages, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle(f"Réponse brute du modèle : {patient_id}")
+        self.resize(700, 500)
+        layout = QVBoxLayout(self)
+        text = QPlainTextEdit()
+        text.setReadOnly(True)
+        text.setFont(QFont("Consolas", 10))
+        text.setPlainText("\n\n".join(f"=== {page.get('filename') or '-'} ===\n{page.get('text', '')}"
+                                       for page in pages))
+        layout.addWidget(text)
+        buttons = QDialogButtonBox(QDialogButtonBox.Close)
+        buttons.rejected.connect(self.reject)
+        layout.addWidget(buttons)
 
 
 class VerificationView(QWidget):
-    def __init__(self, project_data, save_callback):
+    def __init__(self, project_data, save_callback, response_loader=None):
         super().__init__()
         self.project_data = project_data
         self.save_callback = save_callback
+        # Raw responses live in the response archive and are read only when asked for
+        self.response_loader = response_loader
         self.current_zoom = 100
         self.current_patient = None
+        self.current_row = -1
         self.current_page_index = 0
         self.current_images = []
         self.image_viewer_visible = False
+        self.page_cache = PageCache()
         self.initUI()
 
     # verification_view.py (modifications dans initUI)
@@ -57,13 +185,31 @@ class VerificationView(QWidget):
                 background-color: #e8eaed;
             }
         """)
-        table_layout.addWidget(self.toggle_btn, alignment=Qt.AlignLeft)
+        self.raw_response_btn = QPushButton("Réponse brute du modèle")
+        self.raw_response_btn.clicked.connect(self.show_raw_response)
+        self.raw_response_btn.setStyleSheet(self.toggle_btn.styleSheet())
+        self.raw_response_btn.setEnabled(self.response_loader is not None)
+
+        buttons_layout = QHBoxLayout()
+        buttons_layout.addWidget(self.toggle_btn)
+        buttons_layout.addWidget(self.raw_response_btn)
+        buttons_layout.addStretch()
+        table_layout.addLayout(buttons_layout)
 
         # Data table
-        self.table = QTableWidget()
-        self.table.setEditTriggers(QTableWidget.AllEditTriggers)
+        self.table_model = VerificationTableModel(self.project_data, self.save_callback, self)
+        self.table = QTableView()
+        self.table.setModel(self.table_model)
+        self.table.setEditTriggers(QAbstractItemView.AllEditTriggers)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.table.setWordWrap(False)
+        # Fixed row heights and sampled column widths keep large tables instant
+        self.table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.table.verticalHeader().setDefaultSectionSize(ROW_HEIGHT)
+        self.table.horizontalHeader().setResizeContentsPrecision(COLUMN_SIZE_SAMPLE_ROWS)
         self.table.setStyleSheet("""
-            QTableWidget {
+            QTableView {
                 background-color: #ffffff;
                 border: 1px solid #dcdcdc;
                 border-radius: 8px;
@@ -78,11 +224,11 @@ class VerificationView(QWidget):
                 font-weight: bold;
                 color: #333333;
             }
-            QTableWidget::item {
+            QTableView::item {
                 padding: 10px;
                 color: #333333;
             }
-            QTableWidget::item:selected {
+            QTableView::item:selected {
                 background-color: #e8f0fe;
                 color: #1967d2;
             }
@@ -170,13 +316,12 @@ class VerificationView(QWidget):
         self.next_btn.clicked.connect(self.next_page)
         self.zoom_in_btn.clicked.connect(self.zoom_in)
         self.zoom_out_btn.clicked.connect(self.zoom_out)
-        self.table.cellChanged.connect(self.on_cell_changed)
 
         self.load_data()
 
     def toggle_viewer(self):
         """Toggle image viewer visibility"""
-        if self.table.currentRow() < 0 and not self.current_patient:
+        if not self.table.currentIndex().isValid() and not self.current_patient:
             CustomMessageBox.warning(self, "Aucune sélection", "Veuillez sélectionner un patient dans le tableau.")
             return
 
@@ -195,61 +340,64 @@ class VerificationView(QWidget):
             self.toggle_btn.setText("Afficher la visualisation")
             self.toggle_btn.setIcon(QIcon("icons/visibility.png"))
 
+    def show_raw_response(self):
+        """Load the selected patient's raw responses from the archive and show them"""
+        selected = self.table.selectionModel().selectedRows()
+        if not selected:
+            QMessageBox.warning(self, "Aucune sélection", "Veuillez sélectionner un patient dans le tableau.")
+            return
+        patient_id = self.table_model.patient_id(selected[0].row())
+        pages = self.response_loader(patient_id)
+        if not pages:
+            QMessageBox.information(self, "Réponse brute", f"Aucune réponse archivée pour {patient_id}.")
+            return
+        RawResponseDialog(patient_id, pages, self).exec_()
+
     def load_data(self):
-        self.table.blockSignals(True)
-        try:
-            self.table.clear()
-
-            if not self.project_data.get('extracted_data'):
-                return
-
-            # Setup headers
-            headers = ["Patient"] + [v['name'] if isinstance(v, dict) else str(v)
-                                     for v in self.project_data.get('variables', [])] + ["Erreurs"]
-            self.table.setColumnCount(len(headers))
-            self.table.setHorizontalHeaderLabels(headers)
-
-            # Populate rows
-            for row, (patient_id, data) in enumerate(self.project_data['extracted_data'].items()):
-                self.table.insertRow(row)
-                self.table.setItem(row, 0, QTableWidgetItem(patient_id))
-
-                for col, var in enumerate(self.project_data['variables'], start=1):
-                    value = str(data["data"]["variables"].get(var['name'] if isinstance(var, dict) else var, ""))
-                    item = QTableWidgetItem(value)
-                    if '?' in value:
-                        item.setBackground(QColor("#fce8e6")) # Soft red for attention
-                    self.table.setItem(row, col, item)
-
-                errors = "\n".join(data["data"].get("errors", []))
-                if data.get("error"):
-                    errors += f"\n{data['error']}"
-                self.table.setItem(row, len(headers) - 1, QTableWidgetItem(errors))
-
-        finally:
-            self.table.blockSignals(False)
+        self.table_model.set_project_data(self.project_data)
+        self.patients_by_id = {os.path.basename(p['patient_dir']): p
+                               for p in self.project_data.get('compiled_questionnaires', [])}
+        if self.table_model.rowCount():
             self.table.resizeColumnsToContents()
 
     def on_row_selected(self):
         """When a row is selected in the table"""
-        selected = self.table.selectedItems()
+        selected = self.table.selectionModel().selectedRows()
         if not selected:
             return
 
-        patient_id = self.table.item(selected[0].row(), 0).text()
-
-        for patient in self.project_data['compiled_questionnaires']:
-            if os.path.basename(patient['patient_dir']) == patient_id:
-                self.current_patient = patient
-                self.current_page_index = 0
-                self.current_images = sorted(
-                    [f for f in os.listdir(patient['patient_dir'])
-                     if f.lower().endswith(('.png', '.jpg', '.jpeg'))],
-                    key=lambda x: [int(c) if c.isdigit() else c for c in re.split('([0-9]+)', x)]
-                )
-                if self.image_viewer_visible:
-                    self.show_current_page()
-                break
+        self.current_row = selected[0].row()
+        patient_id = self.table_model.patient_id(self.current_row)
+        patient = self.patients_by_id.get(patient_id)
+        if patient:
+            self.current_patient = patient
+            self.current_page_index = 0
+            self.current_images = self.page_cache.list_pages(patient['patient_dir'])
+            if self.image_viewer_visible:
+                self.show_current_page()
+
+    def _page_path(self, index):
+        if 0 <= index < len(self.current_images):
+            return os.path.join(self.current_patient['patient_dir'], self.current_images[index])
+        return None
+
+    def prefetch_neighbours(self):
+        """Decode the previous and next pages and the next patient's first page in the background"""
+        paths = [self._page_path(self.current_page_index + 1), self._page_path(self.current_page_index - 1)]
+        next_row = self.current_row + 1
+        if 0 < next_row < self.table_model.rowCount():
+            next_patient = self.patients_by_id.get(self.table_model.patient_id(next_row))
+            if next_patient:
+                pages = self.page_cache.list_pages(next_patient['patient_dir'])
+                if pages:
+                    paths.append(os.path.join(next_patient['patient_dir'], pages[0]))
+        self.page_cache.prefetch([p for p in paths if p], self.current_zoom)
+        # The current page at the next zoom steps, so that zooming does not decode on the GUI thread;
+        # at high zoom the page is too large to keep and prefetch skips it
+        current = self._page_path(self.current_page_index)
+        for zoom in (self.current_zoom + ZOOM_STEP, self.current_zoom - ZOOM_STEP):
+            if MIN_ZOOM <= zoom <= MAX_ZOOM:
+                self.page_cache.prefetch([current], zoom)
 
     def show_current_page(self):
         """Display current page image"""
@@ -257,19 +405,18 @@ class VerificationView(QWidget):
             self.image_label.setText("Aucune image disponible")
             return
 
-        img_path = os.path.join(self.current_patient['patient_dir'],
-                                self.current_images[self.current_page_index])
-        pixmap = QPixmap(img_path)
+        # Already decoded at the displayed size: no rescaling here
+        image = self.page_cache.get(self._page_path(self.current_page_index), self.current_zoom)
 
-        if pixmap.isNull():
+        if image is None:
             self.image_label.setText("Image non valide")
             return
 
-        scaled = pixmap.scaledToWidth(int(pixmap.width() * (self.current_zoom / 100)))
-        self.image_label.setPixmap(scaled)
+        self.image_label.setPixmap(QPixmap.fromImage(image))
         self.page_label.setText(f"Page: {self.current_page_index + 1}/{len(self.current_images)}")
         self.prev_btn.setEnabled(self.current_page_index > 0)
         self.next_btn.setEnabled(self.current_page_index < len(self.current_images) - 1)
+        self.prefetch_neighbours()
 
     def prev_page(self):
         if self.current_page_index > 0:
@@ -282,28 +429,17 @@ class VerificationView(QWidget):
             self.show_current_page()
 
     def zoom_in(self):
-        self.current_zoom = min(300, self.current_zoom + 25)
+        self.current_zoom = min(MAX_ZOOM, self.current_zoom + ZOOM_STEP)
         self.show_current_page()
 
     def zoom_out(self):
-        self.current_zoom = max(50, self.current_zoom - 25)
+        self.current_zoom = max(MIN_ZOOM, self.current_zoom - ZOOM_STEP)
         self.show_current_page()
 
-    def on_cell_changed(self, row, column):
-        """Handle data edits"""
-        try:
-            patient_id = self.table.item(row, 0).text()
-            var_name = self.table.horizontalHeaderItem(column).text()
-            new_value = self.table.item(row, column).text()
-
-            if patient_id in self.project_data['extracted_data']:
-                self.project_data['extracted_data'][patient_id]["data"]["variables"][var_name] = new_value
-                self.save_callback()
-        except Exception as e:
-            print(f"Error saving change: {e}")
-
     def update_view(self, project_data=None):
         """Refresh view with new data"""
         if project_data:
+            if project_data is not self.project_data:
+                self.page_cache.clear()
             self.project_data = project_data
         self.load_data()